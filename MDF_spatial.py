@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------------
+> Spatial mode
+Calibrates (MDF.run) and forward-runs DALEC-Grass for every box/subfield (or pixel) of a field
+and streams the results into one chunked NetCDF file (1 chunk = 1 cell time-series)
+
+> Inputs (created by IDP.drivers_creation(split=(nx,ny),spatial=True) in <workingdir>/DALEC_Grass/inputs)
+<sitename>_M_grid.npy      : drivers (ny,nx,14,weeks)
+<sitename>_O_grid.npy      : LAI observations (ny,nx,weeks)
+<sitename>_coords_grid.npy : cell centre lat/lon (ny,nx,2) [optional]
+Cells with no LAI observations (e.g. outside the field polygon) are skipped
+
+> Output
+<workingdir>/MDF_spatial_<sitename>.nc with dimensions (y,x,time,par)
+---------------------------------------------------------------------------------
+"""
+
+import os
+import multiprocessing
+import numpy as np
+import MDF
+
+
+outvars = ['lai','gpp','nee','graze','cut','soilC'] # mean and std (_std) of the forward runs
+
+
+def calibrate_cell(task) :
+
+	"""
+	> Calibrates and forward-runs DALEC-Grass for one cell (run in a worker process)
+	> Returns the cell index, best parameters/likelihood and the mean/std of the forward runs
+	"""
+
+	import pandas as pd
+
+	workingdir, sitename, y, x, met, obs_lai, lat, sa_kwargs, nosamples = task
+	np.random.seed() # forked workers inherit the parent's random state 
+
+	cellname = '%s_%i_%i' %(sitename,y,x)
+	celldir  = '%s/MDF_spatial_%s' %(workingdir,sitename)
+	MDF.run(workingdir, cellname, met=met, obs_lai=obs_lai, lat=lat, dbname='%s/MDF_outs_%s' %(celldir,cellname), **sa_kwargs)
+
+	## posterior samples (nothing is saved if no feasible parameter set was found)
+	if not os.path.exists('%s/MDF_outs_%s.csv' %(celldir,cellname)) : return y, x, None
+	mcmc_outs = pd.read_csv('%s/MDF_outs_%s.csv' %(celldir,cellname))
+	mcmc_outs = mcmc_outs[np.isfinite(mcmc_outs.like1.astype(float))]
+	mcmc_outs = mcmc_outs.sort_values(by='like1',ascending=False)[:nosamples]
+	if len(mcmc_outs) == 0 : return y, x, None
+
+	## forward runs (reported period, from the setup's first week ; pools hold the initial state in their first row)
+	cell = MDF.abc_dalec(workingdir, cellname, met=met, obs_lai=obs_lai, lat=lat)
+	w = cell.firstweek
+	parcols = [c for c in mcmc_outs.columns if c.startswith('par')]
+	sims = dict((v,[]) for v in outvars)
+	for i in range(len(mcmc_outs)):
+		lai,gpp,nee,pools,fluxes,rem = cell.forward(np.array(mcmc_outs[parcols].iloc[i]))
+		sims['lai'].append(lai[w:])
+		sims['gpp'].append(gpp[w:])
+		sims['nee'].append(nee[w:])
+		sims['graze'].append(rem[0,w:])
+		sims['cut'].append(rem[1,w:])
+		sims['soilC'].append(pools[w+1:,5])
+
+	summary = {}
+	for v in outvars:
+		summary[v] = np.nanmean(sims[v],axis=0)
+		summary['%s_std' %v] = np.nanstd(sims[v],axis=0)
+	summary['pars'] = np.array(mcmc_outs[parcols].iloc[0])
+	summary['like'] = mcmc_outs.like1.iloc[0]
+	summary['nosamples'] = len(mcmc_outs)
+
+	return y, x, summary
+
+
+
+def create_output(ncfile, ny, nx, noweeks, nopars, coords=None, startdate='2017-01-01') :
+
+	"""
+	> Creates the gridded NetCDF output, chunked per cell time-series so cells can be written as they finish
+	"""
+
+	import netCDF4
+
+	nc = netCDF4.Dataset(ncfile,'w')
+	nc.createDimension('y',ny)
+	nc.createDimension('x',nx)
+	nc.createDimension('time',noweeks)
+	nc.createDimension('par',nopars)
+
+	time = nc.createVariable('time','i4',('time',))
+	time.units = 'days since %s' %startdate
+	time[:] = np.arange(noweeks) * 7
+
+	if coords is not None :
+		for i, c in enumerate(['lat','lon']):
+			var = nc.createVariable(c,'f8',('y','x'))
+			var[:] = coords[:,:,i]
+
+	for v in outvars:
+		for name in [v,'%s_std' %v]:
+			nc.createVariable(name,'f4',('y','x','time'),zlib=True,chunksizes=(1,1,noweeks),fill_value=np.nan)
+	nc.createVariable('pars','f8',('y','x','par'),chunksizes=(1,1,nopars),fill_value=np.nan)
+	nc.createVariable('like','f8',('y','x'),fill_value=np.nan)
+	nc.createVariable('nosamples','i4',('y','x'),fill_value=0)
+
+	return nc
+
+
+
+def run(workingdir, sitename, processes=None, nosamples=100, repetitions=10000000, Tini=90, Ntemp=3000, alpha=0.99, lat=50.77) :
+
+	"""
+	> Runs the model-data fusion for every cell of the gridded inputs over a process pool
+	> processes (int) : number of worker processes (default: all cpus)
+	> nosamples (int) : number of best posterior samples used in the forward runs of each cell
+	"""
+
+	inputdir = '%s/DALEC_Grass/inputs' %workingdir
+	met_grid = np.load('%s/%s_M_grid.npy' %(inputdir,sitename))
+	obs_grid = np.load('%s/%s_O_grid.npy' %(inputdir,sitename))
+	coords   = None
+	if os.path.exists('%s/%s_coords_grid.npy' %(inputdir,sitename)) :
+		coords = np.load('%s/%s_coords_grid.npy' %(inputdir,sitename))
+
+	## reported weeks of the forward runs (as calibrate_cell : from the setup's first week)
+	ny, nx = met_grid.shape[:2]
+	setup = MDF.abc_dalec(workingdir, sitename, met=met_grid[0,0], obs_lai=obs_grid[0,0], lat=lat)
+	noweeks = setup.nodays - setup.firstweek
+	os.makedirs('%s/MDF_spatial_%s' %(workingdir,sitename), exist_ok=True)
+
+	sa_kwargs = {'repetitions': repetitions, 'Tini': Tini, 'Ntemp': Ntemp, 'alpha': alpha}
+	tasks = []
+	for y in range(ny):
+		for x in range(nx):
+			if np.all(np.isnan(obs_grid[y,x])) or np.isnan(met_grid[y,x,7]).any() : continue
+			celllat = lat if coords is None else coords[y,x,0]
+			tasks.append((workingdir, sitename, y, x, met_grid[y,x], obs_grid[y,x], celllat, sa_kwargs, nosamples))
+
+	nc = create_output('%s/MDF_spatial_%s.nc' %(workingdir,sitename), ny, nx, noweeks, setup.nopars, coords=coords, startdate=str(setup.dates[setup.firstweek]))
+
+	## write every cell as soon as its worker is done
+	pool = multiprocessing.Pool(processes)
+	try:
+		for y, x, summary in pool.imap_unordered(calibrate_cell, tasks):
+			if summary is None : continue
+			for v in outvars:
+				nc[v][y,x,:] = summary[v]
+				nc['%s_std' %v][y,x,:] = summary['%s_std' %v]
+			nc['pars'][y,x,:] = summary['pars']
+			nc['like'][y,x] = summary['like']
+			nc['nosamples'][y,x] = summary['nosamples']
+			nc.sync()
+	finally:
+		pool.close()
+		pool.join()
+		nc.close()
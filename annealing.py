@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import datetime
+import numpy as np
+from spotpy.algorithms import sa as spotpy_sa
+from spotpy.algorithms.sa import frandom
+
+
+class sa(spotpy_sa) :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Simulated Annealing for MDF.run with an early-stopping controller
+	Same annealing as spotpy.algorithms.sa (start from the prior midpoints, Ntemp trials per temperature,
+	T reduced by alpha) but the run also stops when :
+	  - the best objective improved by less than tol over the last window temperature steps ('plateau')
+	  - the wall-clock budget max_time (s) is used ('max_time')
+	and otherwise, as spotpy, after repetitions evaluations ('repetitions') or at the end of the
+	temperature schedule ('temperature'). The reason is kept as sampler.stop_reason and, for file
+	databases, written with the best objective history to <dbname>_stop.json
+	With checkpoint_every, the full state of the run is checkpointed (see checkpoint.py) at the end of the
+	temperature steps, and a killed run continues from its last checkpoint with sample(..., resume=state)
+	---------------------------------------------------------------------------------
+	"""
+
+	def sample(self, repetitions, Tini=80, Ntemp=50, alpha=0.99, window=None, tol=1e-3, max_time=None, checkpoint_every=None, resume=None):
+
+		"""
+		> repetitions (int) : evaluation budget
+		> Tini / Ntemp / alpha : starting temperature, trials per temperature, temperature reduction
+		> window (int)      : temperature steps over which the best objective must improve by tol (None = no plateau stop)
+		> tol (float)       : minimum improvement of the best objective (-RMSE) over window temperature steps
+		> max_time (float)  : wall-clock budget in seconds (None = no limit)
+		> checkpoint_every (float) : seconds between two checkpoints (None = no checkpoints)
+		> resume (dict)     : state of the checkpoint to continue from (checkpoint.load)
+		"""
+
+		import checkpoint
+
+		self.set_repetiton(repetitions)
+		print('Starting the SA algorithm with %i repetitions...' %repetitions)
+		start = time.time()
+		self.min_bound, self.max_bound = self.parameter()['minbound'], self.parameter()['maxbound']
+		stepsizes = self.parameter()['step']
+		if resume is None :
+			Titer = Tini
+			x = self.parameter()['optguess']
+			Xopt = x
+			_, _, simulations = self.simulate((1, x))
+			Enew = self.postprocessing(1, x, simulations)
+			Eopt = Enew
+			rep = 1
+			self.best_history = [] # best objective at the end of every temperature step
+			self.stop_reason = 'temperature'
+		else :
+			checkpoint.restore(self, resume)
+			Titer, x, Xopt, Enew, Eopt, rep = [resume[k] for k in ['Titer','x','Xopt','Enew','Eopt','rep']]
+			self.best_history, self.stop_reason = resume['best_history'], resume['stop_reason']
+			start -= resume['elapsed']
+
+		def state(finished):
+			return {'Titer': Titer, 'x': x, 'Xopt': Xopt, 'Enew': Enew, 'Eopt': Eopt, 'best_history': self.best_history,
+					'stop_reason': self.stop_reason, 'elapsed': time.time() - start, 'finished': finished}
+
+		while (Titer > 0.001 * Tini) and not (resume or {}).get('finished') :
+			for counter in range(Ntemp):
+				if Enew > Eopt :
+					Eopt, Xopt = Enew, x
+					x = np.random.uniform(low=Xopt - stepsizes, high=Xopt + stepsizes)
+				elif frandom(Enew, Eopt, Titer) :
+					Xopt = x
+					x = np.random.uniform(low=Xopt - stepsizes, high=Xopt + stepsizes)
+				else :
+					x = np.random.normal(loc=Xopt, scale=stepsizes)
+				x = self.check_par_validity(x)
+
+				_, _, simulations = self.simulate((rep + 1, x))
+				Enew = self.postprocessing(rep + 1, x, simulations)
+				rep += 1
+				if self.status.stop : break
+
+			Titer = alpha * Titer
+			self.best_history.append(float(self.status.objectivefunction_max))
+			if self.status.stop or rep >= repetitions :
+				self.stop_reason = 'repetitions'
+				break
+			if (max_time is not None) and (time.time() - start > max_time) :
+				self.stop_reason = 'max_time'
+				break
+			if (window is not None) and plateau(self.best_history, window, tol) :
+				self.stop_reason = 'plateau'
+				break
+			if checkpoint.due(self, checkpoint_every) : checkpoint.save(self, state(False))
+
+		print('SA stopped (%s) after %i evaluations and %i temperature steps' %(self.stop_reason, rep, len(self.best_history)))
+		self.stop = {'stop_reason': self.stop_reason, 'evaluations': rep, 'repetitions': repetitions,
+					 'temperature_steps': len(self.best_history), 'temperature': Titer, 'elapsed': time.time() - start,
+					 'best_like': float(self.status.objectivefunction_max), 'best_history': self.best_history,
+					 'window': window, 'tol': tol, 'max_time': max_time, 'date': datetime.datetime.now().isoformat()}
+		if checkpoint_every is not None : checkpoint.save(self, state(True))
+		self.final_call()
+		if self.dbformat in ['csv','hdf5','sql'] : write_stop(self.dbname, self.stop)
+
+
+
+def plateau(best_history, window, tol):
+
+	"""
+	> True when the best objective improved by less than tol over the last window temperature steps
+	  (only once a feasible parameter set has been found)
+	"""
+
+	if len(best_history) <= window : return False
+	now, before = best_history[-1], best_history[-1-window]
+	if before <= -1e300 : return False # spotpy's initial best (-1e308) : nothing feasible yet
+	return now - before < tol
+
+
+
+def write_stop(dbname, info):
+
+	"""
+	> Writes why (and when) the run stopped to <dbname>_stop.json (atomic replace)
+	"""
+
+	stopfile = '%s_stop.json' %dbname
+	with open(stopfile + '.tmp','w') as f : json.dump(info, f, indent=1)
+	os.replace(stopfile + '.tmp', stopfile)
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------------
+> Benchmark suite
+Times the DALEC-Grass kernel, the likelihood, a fixed length SA run and the drivers_creation
+stages (IDP entry points on a synthetic field) using the bundled greatfield_M.npy / greatfield_O.npy (and the best
+parameter sets of a greatfield DE-MC run, benchmarks/greatfield_outs.csv, as the SA warm start), and saves the
+results with the machine and commit info to benchmarks/results/<host>_<commit>.json
+(compare two result files with benchmarks/compare.py)
+
+> Usage (from the repo root)
+python benchmarks/bench.py                     # all benchmarks
+python benchmarks/bench.py --quick             # fewer repeats
+python benchmarks/bench.py --only kernel sa    # some benchmarks
+Benchmarks whose packages are not installed are recorded as skipped (and failing ones as failed)
+---------------------------------------------------------------------------------
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import datetime
+import tempfile
+import subprocess
+import numpy as np
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+outsloc = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'greatfield_outs.csv') # feasible parameter sets of greatfield
+sys.path.insert(0, repodir)
+
+benchmarks = {} # name : function(repeat) -> dict of results
+
+
+def benchmark(func):
+	benchmarks[func.__name__[len('bench_'):]] = func
+	return func
+
+
+def timeit(func, repeat, number=1):
+
+	"""
+	> Runs func() number times per repeat and returns the per-call time statistics (s)
+	"""
+
+	times = []
+	for r in range(repeat):
+		t0 = time.perf_counter()
+		for n in range(number): func()
+		times.append((time.perf_counter() - t0) / number)
+	times = np.array(times)
+	return {'unit': 's', 'min': float(times.min()), 'median': float(np.median(times)),
+			'mean': float(times.mean()), 'std': float(times.std()), 'repeat': repeat, 'number': number}
+
+
+def greatfield():
+	from dalec_core import dalec_core
+	return dalec_core(repodir, 'greatfield')
+
+
+def mid_pars():
+	## prior midpoints : pass the parameter checks, so the kernel and all constraints are evaluated
+	from dalec_core import pars_lims
+	return np.array([np.mean(pars_lims[i]) for i in range(34)])
+
+
+
+### ---------------------------------------------------------------------------------
+### Model and MDF
+
+@benchmark
+def bench_kernel(repeat):
+	site = greatfield()
+	pars = np.array(mid_pars(), order='F')
+	out  = timeit(lambda: site.forward(pars), repeat, number=20)
+	out['per_week'] = out['median'] / site.nodays
+	out['weeks'] = site.nodays
+	return out
+
+
+@benchmark
+def bench_simulation(repeat):
+	site = greatfield()
+	pars = mid_pars()
+	return timeit(lambda: site.simulation(pars), repeat, number=20)
+
+
+@benchmark
+def bench_simulation_rejected(repeat):
+	## proposal rejected by the parameter checks (no kernel call)
+	site = greatfield()
+	pars = mid_pars()
+	pars[21] = pars[20]
+	return timeit(lambda: site.simulation(pars), repeat, number=1000)
+
+
+@benchmark
+def bench_simulations(repeat, nChains=6):
+	## a DE-MC generation : nChains feasible proposals evaluated one at a time and in one batch (dalec_core.simulations)
+	import pandas as pd
+	site = greatfield()
+	X = np.array(pd.read_csv(outsloc).iloc[:nChains,1:], dtype=float)
+	out = {'single': timeit(lambda: [site.simulation(x) for x in X], repeat, number=20),
+		   'batch': timeit(lambda: site.simulations(X), repeat, number=20), 'nChains': nChains}
+	out['speedup'] = out['single']['median'] / out['batch']['median']
+	out['median'] = out['batch']['median']
+	return out
+
+
+@benchmark
+def bench_sa(repeat, repetitions=2000):
+
+	"""
+	> SA calibration of greatfield warm-started from the bundled feasible parameter sets (greatfield_outs.csv, best
+	  rows of a DE-MC run) : from the default start no feasible set is found in a short run, which would only time
+	  the rejection path
+	"""
+
+	import MDF
+	runs = []
+	def calibrate():
+		np.random.seed(0)
+		runs.append(MDF.run(repodir, 'greatfield', repetitions=repetitions, Ntemp=100, dbformat='ram', window=None, warmstart=outsloc))
+	out = timeit(calibrate, max(1,repeat//5))
+	like = np.array(runs[-1].getdata()['like1'], dtype=float)
+	assert np.isfinite(like).any(), 'SA benchmark : no feasible parameter set'
+	out['repetitions'] = repetitions
+	out['per_evaluation'] = out['median'] / repetitions
+	out['feasible'] = int(np.isfinite(like).sum())
+	out['best_like'] = float(np.nanmax(np.where(np.isfinite(like), like, np.nan)))
+	return out
+
+
+@benchmark
+def bench_import(repeat):
+
+	"""
+	> Start-up cost of a worker process : import time and max RSS of MDF (fresh interpreter)
+	"""
+
+	out = {}
+	for module in ['dalec_core','MDF']:
+		code = ('import time, resource ; t0 = time.perf_counter() ; import %s ; '
+				'print(time.perf_counter()-t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)' %module)
+		res = [subprocess.check_output([sys.executable,'-c',code], cwd=repodir).split() for r in range(repeat)]
+		times = np.array([float(r[0]) for r in res])
+		out[module] = {'unit': 's', 'min': float(times.min()), 'median': float(np.median(times)),
+					   'maxrss_kb': int(np.median([int(r[1]) for r in res]))}
+	out['median'] = out['MDF']['median']
+	return out
+
+
+
+### ---------------------------------------------------------------------------------
+### drivers_creation stages (synthetic data, see synthetic_field)
+
+@benchmark
+def bench_lai_reduction(repeat):
+	import pandas as pd
+	from input_data_production import IDP
+	idp = IDP.__new__(IDP) # LAI_reduction uses no instance state
+	dates = pd.date_range('2017-01-01','2019-12-31',freq='4D')
+	rf_LAI = pd.Series(3 + 2*np.sin(np.arange(len(dates))/15.), index=dates)
+	return timeit(lambda: idp.LAI_reduction(rf_LAI), repeat)
+
+
+@benchmark
+def bench_lai_rf(repeat, nofields=50):
+	import pandas as pd
+	from lai_retrieval import LAI_RF
+	rng = np.random.RandomState(0)
+	def frame(n):
+		DF = pd.DataFrame({'band1': rng.rand(n), 'band2': rng.rand(n), 'DOY': rng.randint(1,366,n), 'vpd': rng.rand(n)*1000},
+						  index=pd.date_range('2017-01-01', periods=n, freq='D'))
+		DF['lai'] = 5*DF.band1/(DF.band2+0.1) + rng.rand(n)
+		return DF
+	with tempfile.TemporaryDirectory() as tmp:
+		rf = LAI_RF('%s/rf.joblib' %tmp, n_estimators=50)
+		train = timeit(lambda: rf.train(frame(2000)), max(1,repeat//5))
+		fields = dict(('f%i' %i, frame(365)) for i in range(nofields))
+		predict = timeit(lambda: rf.predict_fields(fields), repeat)
+	return {'train': train, 'predict_fields': predict, 'nofields': nofields, 'median': train['median'] + predict['median']}
+
+
+@benchmark
+def bench_driver_store(repeat, nosites=100):
+	from driver_store import DriverStore
+	met, obs = np.load('%s/greatfield_M.npy' %repodir), np.load('%s/greatfield_O.npy' %repodir)
+	with tempfile.TemporaryDirectory() as tmp:
+		def put():
+			with DriverStore('%s/store.h5' %tmp, 'a') as ds:
+				for i in range(nosites): ds.put('site%i' %i, met, obs, lat=50., lon=-4.)
+		put_t = timeit(put, repeat)
+		ds = DriverStore('%s/store.h5' %tmp)
+		get_t = timeit(lambda: [ds.get('site%i' %i) for i in range(nosites)], repeat)
+		ds.close()
+	return {'put': put_t, 'get': get_t, 'nosites': nosites, 'median': put_t['median'] + get_t['median']}
+
+
+def synthetic_field(workingdir, size=40, scenes_per_year=12, years=range(2017,2020)):
+
+	"""
+	> Small synthetic field (the bundled greatfield.geojson) laid out as the IDP expects it in workingdir :
+	  processed S1 (VH/VV) and S2 (LAI) GeoTIFFs of size x size pixels around the field (scenes_per_year in
+	  each of the years), hourly ERA5 files of a 2x2 grid around its centroid and a daily CO2 csv
+	> Returns the IDP instance of the field
+	"""
+
+	import netCDF4
+	import rasterio
+	import pandas as pd
+	from rasterio.transform import from_origin
+	from shapely.geometry import shape
+	from input_data_production import IDP
+
+	jsonloc = '%s/greatfield.geojson' %repodir
+	idp = IDP(jsonloc, workingdir, '%s-01-01' %years[0], '%s-12-31' %years[-1], '', '', workingdir, '', 40)
+	with open(jsonloc) as f: poly = shape(json.load(f)['features'][0]['geometry'])
+	minx, miny, maxx, maxy = poly.bounds
+	res = max(maxx-minx, maxy-miny) / (size-10)
+	transform = from_origin(minx-5*res, maxy+5*res, res, res)
+	rng = np.random.RandomState(0)
+	s1dir = '%s/s1_data/ASF_downloads/processed' %workingdir
+	s2dir = '%s/AWS_downloads/processed' %idp.s2_data_dir
+	for d in [s1dir, s2dir, idp.met_data_dir]: os.makedirs(d, exist_ok=True)
+
+	for year in years:
+		for k in range(scenes_per_year):
+			date = datetime.date(year,1,15) + datetime.timedelta(days=int(365/scenes_per_year)*k)
+			lai = 2.5 + 2*np.sin(2*np.pi*(date.timetuple().tm_yday-100)/365.)
+			with rasterio.open('%s/Subset_S1A_IW_GRDH_1SDV_%sT061234_Orb_NR_Cal_ML_TC_dB.tif' %(s1dir,date.strftime('%Y%m%d')), 'w', driver='GTiff',
+							   height=size, width=size, count=2, dtype='float32', crs='EPSG:4326', transform=transform, nodata=0) as dst:
+				dst.write(np.array([0.02*lai + 0.005*rng.rand(size,size) + 0.001, 0.05 + 0.005*rng.rand(size,size)], dtype='float32'))
+			with rasterio.open('%s/S2A_MSIL2A_T30UVB__%s_p2.tif' %(s2dir,date.strftime('%Y%m%d')), 'w', driver='GTiff',
+							   height=size, width=size, count=1, dtype='float32', crs='EPSG:4326', transform=transform, nodata=0) as dst:
+				dst.write(np.array([lai + 0.2*rng.rand(size,size)], dtype='float32'))
+
+	cx, cy = poly.centroid.x, poly.centroid.y
+	for year in years:
+		hours = 24*(366 if year % 4 == 0 else 365)
+		nc = netCDF4.Dataset('%s/ERA5_%s_%s.nc' %(idp.met_data_dir,idp.fieldname,year), 'w')
+		for dim, n in [('time',hours),('latitude',2),('longitude',2)]: nc.createDimension(dim, n)
+		nc.createVariable('time','i4',('time',)).units = 'hours since %s-01-01' %year
+		nc['time'][:] = np.arange(hours)
+		nc.createVariable('latitude','f4',('latitude',))[:] = [cy+0.05, cy-0.05]
+		nc.createVariable('longitude','f4',('longitude',))[:] = [cx-0.05, cx+0.05]
+		t = np.arange(hours)
+		season, daily = -np.cos(2*np.pi*t/hours), -np.cos(2*np.pi*t/24.)
+		for v, val in [('t2m', 283 + 7*season + 4*daily), ('d2m', 279 + 6*season + 2*daily), ('sp', 1e5 + 0*t), ('ssrd', np.maximum(0, 2e6*(1+0.7*season)*daily))]:
+			nc.createVariable(v,'f4',('time','latitude','longitude'))[:] = np.repeat(np.repeat(val[:,None,None],2,1),2,2)
+		nc.close()
+
+	days = pd.date_range('%s-01-01' %years[0], '%s-12-31' %years[-1], freq='D')
+	pd.DataFrame({'YYYY': days.year, 'MM': days.month, 'DD': days.day, 'ppm': 400 + 0.006*np.arange(len(days))}).to_csv('%s/co2.csv' %workingdir, index=False)
+	return idp
+
+
+@benchmark
+def bench_box_stats(repeat, size=2000, split=(5,5)):
+
+	"""
+	> Per box/subfield statistics of one S1 scene of size x size pixels (field_registry.box_stats, one pass over
+	  the raster per band for all boxes), as used by drivers_creation and the shared scene processing
+	"""
+
+	import glob
+	from field_registry import FieldRegistry
+
+	with tempfile.TemporaryDirectory() as tmp:
+		idp = synthetic_field(tmp, size=size, scenes_per_year=1)
+		polygon, boxinfo, boxes = idp.field_boxes(split)
+		tif = sorted(glob.glob('%s/s1_data/ASF_downloads/processed/*.tif' %tmp))[0]
+		out = timeit(lambda: idp.box_stats(tif, boxes, split, bands=(1,2), stats=['mean','std']), repeat)
+	out['pixels'] = size*size
+	out['noboxes'] = len(boxinfo)
+	return out
+
+
+@benchmark
+def bench_met_netcdf(repeat):
+
+	"""
+	> ERA5 stage of drivers_creation (IDP.met_data) : three years of hourly ERA5 data at the field's nearest
+	  point aggregated to daily min/max T, srad, VPD, photoperiod and their 21 day averages
+	"""
+
+	with tempfile.TemporaryDirectory() as tmp:
+		idp = synthetic_field(tmp, size=20, scenes_per_year=1)
+		polygon = idp.field_boxes()[0]
+		return timeit(lambda: idp.met_data(polygon.centroid.y, polygon.centroid.x), repeat)
+
+
+@benchmark
+def bench_drivers_creation(repeat, size=40, scenes_per_year=12):
+
+	"""
+	> IDP.drivers_creation of the synthetic field (S1/S2 box statistics, ERA5, LAI model, spatial inputs) :
+	  first call training the tile's LAI model, then calls loading it
+	"""
+
+	with tempfile.TemporaryDirectory() as tmp:
+		idp = synthetic_field(tmp, size=size, scenes_per_year=scenes_per_year)
+		kwargs = {'spatial': True, 'co2loc': '%s/co2.csv' %tmp}
+		train = timeit(lambda: idp.drivers_creation(**kwargs), 1)
+		out = timeit(lambda: idp.drivers_creation(**kwargs), max(1,repeat//5))
+	out['train'] = train['median']
+	out['scenes'] = 3*scenes_per_year
+	return out
+
+
+
+### ---------------------------------------------------------------------------------
+
+def machine_info():
+	import spotpy
+	info = {'host': socket.gethostname(), 'platform': platform.platform(), 'processor': platform.processor(),
+			'cpus': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__, 'spotpy': spotpy.__version__}
+	try :
+		info['commit'] = subprocess.check_output(['git','rev-parse','HEAD'], cwd=repodir, text=True).strip()
+		info['dirty'] = len(subprocess.check_output(['git','status','--porcelain','--untracked-files=no'], cwd=repodir, text=True).strip()) > 0
+	except Exception :
+		info['commit'], info['dirty'] = 'unknown', None
+	return info
+
+
+def run(names=None, repeat=10, outfile=None):
+
+	"""
+	> Runs the benchmarks (all or names) and saves the results, returns the results dict
+	"""
+
+	results = {'machine': machine_info(), 'date': datetime.datetime.now().isoformat(), 'benchmarks': {}}
+	for name in (names or list(benchmarks)):
+		try :
+			results['benchmarks'][name] = benchmarks[name](repeat)
+			print ('%-20s %10.3e s' %(name, results['benchmarks'][name]['median']))
+		except ImportError as e :
+			results['benchmarks'][name] = {'skipped': str(e)}
+			print ('%-20s skipped (%s)' %(name, e))
+		except Exception as e :
+			results['benchmarks'][name] = {'failed': repr(e)}
+			print ('%-20s failed (%r)' %(name, e))
+
+	if outfile is None :
+		os.makedirs('%s/benchmarks/results' %repodir, exist_ok=True)
+		outfile = '%s/benchmarks/results/%s_%s.json' %(repodir, results['machine']['host'], results['machine']['commit'][:10])
+	with open(outfile, 'w') as f: json.dump(results, f, indent=1)
+	print ('saved %s' %outfile)
+	return results
+
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='DALEC-Grass / MDF benchmarks')
+	parser.add_argument('--only', nargs='+', choices=list(benchmarks), help='benchmarks to run')
+	parser.add_argument('--repeat', type=int, default=10, help='repeats per benchmark')
+	parser.add_argument('--quick', action='store_true', help='3 repeats per benchmark')
+	parser.add_argument('--out', help='results file (default benchmarks/results/<host>_<commit>.json)')
+	args = parser.parse_args()
+	run(args.only, 3 if args.quick else args.repeat, args.out)
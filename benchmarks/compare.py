@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------------
+> Compares two benchmark result files (see bench.py), e.g. two commits on the same machine
+
+> Usage
+python benchmarks/compare.py <baseline.json> <new.json> [--threshold 1.2]
+Prints the median time ratio (new / baseline) of every benchmark and exits with status 1
+if any benchmark is slower than threshold x baseline
+---------------------------------------------------------------------------------
+"""
+
+import sys
+import json
+import argparse
+
+
+def compare(baseline, new, threshold=1.2):
+
+	"""
+	> Returns {benchmark : ratio} and the list of regressions (ratio > threshold)
+	"""
+
+	ratios, regressions = {}, []
+	for name, res in new['benchmarks'].items():
+		base = baseline['benchmarks'].get(name, {})
+		if ('median' not in res) or ('median' not in base) : continue
+		ratios[name] = res['median'] / base['median']
+		if ratios[name] > threshold : regressions.append(name)
+	return ratios, regressions
+
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+	parser.add_argument('baseline')
+	parser.add_argument('new')
+	parser.add_argument('--threshold', type=float, default=1.2, help='slow-down ratio flagged as a regression')
+	args = parser.parse_args()
+
+	with open(args.baseline) as f: baseline = json.load(f)
+	with open(args.new) as f: new = json.load(f)
+
+	for res in [baseline, new]:
+		m = res['machine']
+		print ('%s : %s %s (%s, %s cpus, python %s)' %(res['date'][:19], m['commit'][:10], '(dirty)' if m.get('dirty') else '', m['host'], m['cpus'], m['python']))
+	if baseline['machine']['host'] != new['machine']['host'] : print ('[!] results from different machines')
+
+	ratios, regressions = compare(baseline, new, args.threshold)
+	print ('\n%-20s %12s %12s %8s' %('benchmark','baseline (s)','new (s)','ratio'))
+	for name, ratio in ratios.items():
+		print ('%-20s %12.3e %12.3e %8.2f %s' %(name, baseline['benchmarks'][name]['median'], new['benchmarks'][name]['median'], ratio, '<-- slower' if name in regressions else ''))
+
+	sys.exit(1 if len(regressions) > 0 else 0)
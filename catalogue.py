@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+from dalec_core import pars_lims
+
+
+params = ['P%i' %(i+1) for i in range(len(pars_lims))]
+
+
+class Catalogue() :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Catalogue of the calibration results of many sites (one SQLite file, see MDF.run(catalogue=...))
+	Every registered MDF run keeps, next to the location of its raw outputs :
+	runs      : site, period (first/last week), centroid, algorithm, evaluations, best objective, stop reason
+	summaries : posterior summary of every parameter (best, mean, std, 5/50/95 % quantiles of the best top
+	            fraction of the feasible parameter sets, or of all the post burn-in chain states of DE-MC)
+	topk      : the k best parameter sets
+	indexed on site, period, objective, centroid and parameter summaries, so that questions over many sites
+	are answered without re-reading the sampler outputs, e.g.
+	cat = Catalogue('MDF_catalogue.sqlite')
+	cat.best(bbox=(-4.,50.,-3.,51.))                # best parameters of every field in a region
+	cat.where('P30', 'mean', min=20000)             # fields whose posterior initial SOM exceeds 20000 gC.m-2
+	cat.topk('greatfield', k=10) ; cat.posterior('greatfield')
+
+	> User inputs
+	dbloc (str) : location of the SQLite file (created if needed)
+	---------------------------------------------------------------------------------
+	"""
+
+	def __init__(self, dbloc):
+
+		self.dbloc = dbloc
+		self.db = sqlite3.connect(dbloc, timeout=60)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		with self.db :
+			self.db.execute('''CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, site TEXT, outputs TEXT, algorithm TEXT,
+							   created TEXT, start_date TEXT, end_date TEXT, lat REAL, lon REAL, evaluations INTEGER,
+							   nosamples INTEGER, best_like REAL, stop_reason TEXT)''')
+			self.db.execute('''CREATE TABLE IF NOT EXISTS summaries (run_id INTEGER, param TEXT, best REAL, mean REAL, std REAL,
+							   q05 REAL, q50 REAL, q95 REAL)''')
+			self.db.execute('CREATE TABLE IF NOT EXISTS topk (run_id INTEGER, rank INTEGER, like1 REAL, %s)' %', '.join('%s REAL' %p for p in params))
+			for index in ['runs (site, created)', 'runs (start_date, end_date)', 'runs (best_like)', 'runs (lat, lon)',
+						  'summaries (param, mean)', 'summaries (run_id)', 'topk (run_id, rank)']:
+				self.db.execute('CREATE INDEX IF NOT EXISTS idx_%s ON %s' %('_'.join(index.replace(',','').replace('(','').replace(')','').split()), index))
+
+
+	def close(self):
+		self.db.close()
+
+
+	def register(self, outs, site, outputs=None, algorithm=None, dates=None, lat=None, lon=None, evaluations=None, stop_reason=None, top=0.05, k=10, burnin=0.):
+
+		"""
+		> Registers the results of a run
+		> outs : MDF output csv location, results DataFrame or sampler.getdata() array
+		> dates : (first, last) date of the calibration period
+		> lat / lon : centroid of the site (None = unknown, stored as NULL)
+		> top : fraction of the best parameter sets summarised (1 = all, e.g. the samples of an MCMC)
+		> burnin : fraction of the first rows (in run order) left out of the summaries, e.g. the burn-in generations of DE-MC
+		  (the best parameter sets, topk, are taken from all rows)
+		> Returns the run_id (runs without a feasible parameter set are registered with nosamples = 0)
+		"""
+
+		if isinstance(outs, str) :
+			outputs = outputs or os.path.abspath(outs)
+			outs = pd.read_csv(outs, usecols=lambda c: (c == 'like1') or c.startswith('par'))
+		else : outs = pd.DataFrame(outs)
+		sample = outs.iloc[int(burnin*len(outs)):]
+		sample = sample[np.isfinite(sample.like1.astype(float))].sort_values(by='like1', ascending=False)
+		outs = outs[np.isfinite(outs.like1.astype(float))].sort_values(by='like1', ascending=False)
+		dates = dates or (None, None)
+
+		with self.db :
+			cur = self.db.execute('INSERT INTO runs VALUES (NULL,?,?,?,?,?,?,?,?,?,?,?,?)',
+								  (site, outputs, algorithm, datetime.datetime.now().isoformat(), none_or(str, dates[0]), none_or(str, dates[1]),
+								   none_or(float, lat), none_or(float, lon), none_or(int, evaluations), len(outs),
+								   float(outs.like1.iloc[0]) if len(outs) > 0 else None, stop_reason))
+			run_id = cur.lastrowid
+			if len(outs) == 0 : return run_id
+
+			parcols = ['par%s' %p for p in params]
+			if len(sample) == 0 : sample = outs
+			post = np.array(sample[parcols].iloc[:max(1, int(top*len(sample)))], dtype=float)
+			q05, q50, q95 = np.percentile(post, [5,50,95], axis=0)
+			self.db.executemany('INSERT INTO summaries VALUES (?,?,?,?,?,?,?,?)',
+								[(run_id, p, post[0,i], post[:,i].mean(), post[:,i].std(), q05[i], q50[i], q95[i]) for i, p in enumerate(params)])
+			self.db.executemany('INSERT INTO topk VALUES (%s)' %','.join(['?']*(3+len(params))),
+								[(run_id, r+1, float(outs.like1.iloc[r])) + tuple(float(v) for v in outs[parcols].iloc[r]) for r in range(min(k, len(outs)))])
+		return run_id
+
+
+	def register_run(self, sampler, setup, algorithm='sa', lat=None, lon=None, **kwargs):
+
+		"""
+		> Registers an MDF.run (spotpy sampler with a csv database, its dalec_core setup)
+		> lat / lon : centroid of the site, default the setup's if it is known (sites of a driver store) ; the
+		  latitude of sites read from npy files or arrays is the model default, so their centroid is stored as NULL
+		> DE-MC runs are summarised over all the chain states after the burn-in (first half of the generations)
+		"""
+
+		csv = '%s.csv' %sampler.dbname
+		outs = csv if os.path.exists(csv) else pd.DataFrame({'like1': []}) # nothing saved : no feasible parameter set
+		if (lat is None) and (lon is None) and (none_or(float, getattr(setup, 'lon', None)) is not None) : lat, lon = setup.lat, setup.lon
+		if algorithm == 'demc' : kwargs = dict({'burnin': 0.5, 'top': 1.}, **kwargs)
+		return self.register(outs, setup.sitename, outputs=os.path.abspath(csv), algorithm=algorithm, dates=(setup.dates[setup.firstweek], setup.dates[-1]),
+							 lat=lat, lon=lon, evaluations=sampler.status.rep, stop_reason=getattr(sampler, 'stop_reason', None), **kwargs)
+
+
+	def import_outputs(self, pattern, **kwargs):
+
+		"""
+		> Registers existing MDF outputs (glob pattern of MDF_outs_<site>.csv files, site taken from the file name)
+		"""
+
+		run_ids = []
+		for csv in sorted(glob.glob(pattern)):
+			site = os.path.basename(csv)[:-len('.csv')].replace('MDF_outs_', '')
+			run_ids.append(self.register(csv, site, **kwargs))
+		return run_ids
+
+
+	def runs(self, sites=None, bbox=None, start=None, end=None, min_like=None, latest=True):
+
+		"""
+		> Registered runs (DataFrame)
+		> sites : list of sites (e.g. from FieldRegistry.query) | bbox : (lon min, lat min, lon max, lat max)
+		> start / end : runs whose calibration period covers [start, end] | min_like : best objective above
+		> latest : only the latest run of every site
+		"""
+
+		where, args = [], []
+		if sites is not None :
+			sites = list(sites)
+			where.append('site IN (%s)' %','.join(['?']*len(sites)))
+			args += sites
+		if bbox is not None :
+			where.append('lon BETWEEN ? AND ? AND lat BETWEEN ? AND ?')
+			args += [bbox[0], bbox[2], bbox[1], bbox[3]]
+		if start is not None :
+			where.append('start_date <= ?')
+			args.append(str(start))
+		if end is not None :
+			where.append('end_date >= ?')
+			args.append(str(end))
+		if min_like is not None :
+			where.append('best_like >= ?')
+			args.append(min_like)
+		query = 'SELECT * FROM runs%s' %(' WHERE ' + ' AND '.join(where) if where else '')
+		if latest : query = 'SELECT * FROM (%s) r WHERE run_id = (SELECT MAX(run_id) FROM runs WHERE runs.site = r.site)' %query
+		return pd.read_sql_query(query + ' ORDER BY site, run_id', self.db, params=args)
+
+
+	def best(self, **kwargs):
+
+		"""
+		> Best parameter set of every run selected by runs(**kwargs) (DataFrame, one row per run)
+		"""
+
+		runs = self.runs(**kwargs)
+		if len(runs) == 0 : return pd.DataFrame()
+		top = pd.read_sql_query('SELECT * FROM topk WHERE rank = 1 AND run_id IN (%s)' %','.join(['?']*len(runs)), self.db, params=[int(r) for r in runs.run_id])
+		return runs[['run_id','site']].merge(top, on='run_id')
+
+
+	def topk(self, site, k=10):
+
+		"""
+		> The k best parameter sets of the latest run of a site
+		"""
+
+		return pd.read_sql_query('SELECT * FROM topk WHERE run_id = (SELECT MAX(run_id) FROM runs WHERE site = ?) AND rank <= ? ORDER BY rank',
+								 self.db, params=[site, k])
+
+
+	def posterior(self, site):
+
+		"""
+		> Posterior summaries of the parameters of the latest run of a site
+		"""
+
+		return pd.read_sql_query('SELECT * FROM summaries WHERE run_id = (SELECT MAX(run_id) FROM runs WHERE site = ?)',
+								 self.db, params=[site]).set_index('param')
+
+
+	def where(self, param, stat='mean', min=None, max=None, latest=True):
+
+		"""
+		> Runs (latest of every site) whose posterior stat (best, mean, std, q05, q50, q95) of param is within [min, max]
+		"""
+
+		if param not in params : raise ValueError('unknown parameter %s (P1 to P%i)' %(param, len(params)))
+		if stat not in ['best','mean','std','q05','q50','q95'] : raise ValueError('unknown posterior statistic %s' %stat)
+		query = 'SELECT r.*, s.%s AS %s_%s FROM runs r JOIN summaries s ON s.run_id = r.run_id WHERE s.param = ?' %(stat, param, stat)
+		args = [param]
+		if min is not None :
+			query += ' AND s.%s >= ?' %stat
+			args.append(min)
+		if max is not None :
+			query += ' AND s.%s <= ?' %stat
+			args.append(max)
+		if latest : query += ' AND r.run_id = (SELECT MAX(run_id) FROM runs WHERE runs.site = r.site)'
+		return pd.read_sql_query(query + ' ORDER BY r.site', self.db, params=args)
+
+
+
+def none_or(func, value):
+	return None if (value is None) or (isinstance(value, float) and np.isnan(value)) else func(value)
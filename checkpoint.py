@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------------
+> Sampler checkpoints of an MDF run (see MDF.run(resume=..., checkpoint_every=...))
+A checkpoint (<dbname>_checkpoint.pkl, atomic replace) holds the full state of the sampler (SA temperature,
+current and best points, DE-MC population and chain history ...), the numpy RNG state, the spotpy run
+statistics and the size of the csv database at the time of the checkpoint (flushed to disk). On resume the
+csv is cut back to that size, so that the rows written after the last checkpoint are not duplicated, and
+the sampler continues appending to it exactly where the checkpoint was taken
+---------------------------------------------------------------------------------
+"""
+
+import os
+import time
+import pickle
+import datetime
+import numpy as np
+
+
+def checkpointfile(dbname):
+	return '%s_checkpoint.pkl' %dbname
+
+
+
+def save(sampler, state):
+
+	"""
+	> Writes the sampler state (dict) with the RNG, run statistics and database size to the checkpoint
+	"""
+
+	dbsize = None
+	db = getattr(getattr(sampler, 'datawriter', None), 'db', None)
+	if (sampler.dbformat == 'csv') and (db is not None) :
+		db.flush()
+		os.fsync(db.fileno())
+		dbsize = db.tell()
+
+	status = sampler.status
+	state = dict(state, rng=np.random.get_state(), rep=status.rep, objectivefunction_max=status.objectivefunction_max,
+				 params_max=status.params_max, dbsize=dbsize, date=datetime.datetime.now().isoformat())
+	cfile = checkpointfile(sampler.dbname)
+	with open(cfile + '.tmp', 'wb') as f :
+		pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(cfile + '.tmp', cfile)
+	sampler.last_checkpoint = time.time()
+
+
+
+def load(dbname):
+
+	"""
+	> Returns the state of the last checkpoint of a run (None if there is none)
+	"""
+
+	cfile = checkpointfile(dbname)
+	if not os.path.exists(cfile) : return None
+	with open(cfile, 'rb') as f : return pickle.load(f)
+
+
+
+def restore(sampler, state):
+
+	"""
+	> Restores the RNG and run statistics of a checkpoint and cuts the csv database back to its size then
+	"""
+
+	np.random.set_state(state['rng'])
+	status = sampler.status
+	status.rep = state['rep']
+	status.objectivefunction_max = state['objectivefunction_max']
+	status.params_max = state['params_max']
+	if (state['dbsize'] is not None) and os.path.exists(sampler.dbname + '.csv') :
+		with open(sampler.dbname + '.csv', 'r+b') as f : f.truncate(state['dbsize'])
+	sampler.last_checkpoint = time.time()
+	print('Resuming from the checkpoint of %s (%i evaluations)' %(state['date'][:19], state['rep']))
+
+
+
+def due(sampler, every):
+
+	"""
+	> True when the last checkpoint is more than every seconds old
+	"""
+
+	if every is None : return False
+	if not hasattr(sampler, 'last_checkpoint') : sampler.last_checkpoint = time.time()
+	return time.time() - sampler.last_checkpoint > every
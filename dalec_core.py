@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------------
+> DALEC-Grass core : kernel wrapper and likelihood
+Imports only NumPy and the compiled DALEC_GRASS module so that worker processes
+(spatial mode, parallel samplers) start fast ; heavier packages (spotpy, pandas,
+h5py, geospatial/download packages) are only imported by the stages that use them
+---------------------------------------------------------------------------------
+"""
+
+import numpy as np 
+import DALEC_GRASS 
+
+#### DEFAULT PRIORS 
+pars_lims = {0:  [1e-3,  0.1],     # Decomp rate [1e-5, 0.01]
+			1:  [0.43,   0.48],    # GPP to resp fraction [~0.46]
+			2:  [0.75,   1.5],     # GSI sens leaf growth [1.0, 1.025]
+			3:  [0.10,   1.0],     # NPP belowground allocation exponential parameter [0.01, 1.00]
+			4:  [1e-3,   2.0],     # GSI max leaf turnover [1e-5, 0.2]
+			5:  [1e-3,   1e-1],    # TOR roots [0.0001, 0.01]
+			6:  [1e-3,   1e-1],    # TOR litter [0.0001, 0.01]
+			7:  [1e-7,   1e-4],    # TOR SOM [1e-7, 0.001]
+			8:  [0.01,   0.20],    # T factor (Q10) [0.018,  0.08]
+			9:  [7,      25],      # PNUE [7, 20]
+			10: [1e-3,   1.0],     # GSI max labile turnover [1e-6, 0.2]
+			11: [230,    290],     # GSI min T (K) [225, 330] 
+			12: [250,    300],     # GSI max T (K) [225, 330] 
+			13: [3600,   20000],   # GSI min photoperiod (sec) [3600, 36000]
+			14: [35,     55],      # Leaf Mass per Area [20, 60]
+			15: [20,     100],     # initial labile pool size [1, 1000]
+			16: [20,     100],     # initial foliar pool size [1, 1000]
+			17: [40,     2000],    # initial root pool size [1, 1000]
+			18: [40,     2000],    # initial litter pool size [1, 10000]
+			19: [10000,  40000],   # GSI max photoperiod (sec) [3600, 64800]
+			20: [100,    3000],    # GSI min VPD (Pa) [1, 5500] 
+			21: [1000,   5000],    # GSI max VPD (Pa) [1, 5500]
+			22: [1e-3,   0.5],     # critical GPP for LAI growth [1e-10, 0.30]
+			23: [0.96,   1.00],    # GSI sens for leaf senescenece [0.96, 1.00]
+			24: [0.5,    3.0],     # GSI growing stage/step [0.50, 1.5]
+			25: [1.0,    2.0],     # Initial GSI [1.0, 2.0]
+			26: [500,    1500],    # DM min lim for grazing (kg.DM.ha-1)
+			27: [1500,   3000],    # DM min lim for cutting (kg.DM.ha-1)
+			28: [0.25,   0.75],    # leaf:stem allocation [0.05, 0.75]
+			29: [19000,  21000],   # initial SOM pool size [5000, 10000] (UK) 19000, 21000
+			30: [0.015,  0.035],   # livestock demand in DM (1-3% of animal weight) 
+			31: [0.01,   0.10],    # Post-grazing labile loss (fraction)
+			32: [0.50,   0.90],    # Post-cutting labile loss (fraction)
+			33: [0.1,    1.0]}     # min DM removal for grazing instance to occur (g.C.m-2.w-1)
+
+
+class dalec_core() :
+
+	"""
+	> DALEC-Grass setup, forward runs and likelihood (LAI RMSE under ecological constraints) for one site 
+	> Drivers (met) and LAI observations (obs_lai) are read from <workingdir>/<sitename>_M.npy and _O.npy unless given as arrays 
+	  or unless a driver store (DriverStore or location of the .h5 store, see driver_store.py) holding sitename is given 
+	"""
+
+	def __init__(self,workingdir,sitename,met=None,obs_lai=None,lat=50.77,store=None):   
+
+		self.workingdir = workingdir
+		self.sitename = sitename
+
+		## Read site arrays from the driver store 
+		lon = np.nan
+		if store is not None : 
+			if isinstance(store,str) : 
+				## store given by location : its HDF5 handle is closed once the site arrays are read 
+				from driver_store import DriverStore
+				with DriverStore(store) as ds : site = ds.get(self.sitename)
+			else : site = store.get(self.sitename)
+			met, obs_lai = site['met'], site['obs_lai']
+			if not np.isnan(site['lat']) : lat = site['lat']
+			lon = site['lon']
+
+		## Load drivers 
+		if met is None : met = np.load('%s/%s_M.npy' %(self.workingdir,self.sitename))
+		self.met       = np.array(met,order="F")   
+		self.met       = np.append(self.met[:,:52],self.met,axis=1) ## add 1 spinup year 
+		self.met[0,:]  = np.arange(1,len(self.met[0,:])+1) ## re-create index 
+
+		## Fill DALEC-Grass input variables 
+		self.deltat   = np.zeros([(self.met.shape[1])]) + 7 # weekly runs 
+		self.nodays   = self.met.shape[1]
+		self.noyears  = int(self.nodays/float(52)) - 1 # weekly runs 
+		self.start    = 1     
+		self.finish   = int(self.nodays)
+		self.nopools  = 6     
+		self.nofluxes = 21 
+		self.nopars   = 34
+		self.nomet    = self.met.shape[0]
+		self.lat      = lat
+		self.lon      = lon # centroid longitude (known for driver store sites)
+		self.version_code = 1
+
+		## Weekly date axis (drivers start on 2016-01-01 incl. the spinup year) and first week of the reported period (2017)
+		self.dates     = np.datetime64('2016-01-01') + 7*np.arange(self.nodays)
+		self.firstweek = int(np.argmax(self.dates >= np.datetime64('2017-01-01')))
+
+		#### Load LAI observations 
+		if obs_lai is None : obs_lai = np.load("%s/%s_O.npy" %(self.workingdir,self.sitename)) 
+		self.obs_lai = np.array(obs_lai)
+		self.noobs   = int((~np.isnan(self.obs_lai[:-1])).sum()) # number of LAI observations (likelihood of population samplers)
+		self.rejected = None # name of the constraint that rejected the last simulation 
+
+
+	def forward(self,pars) : 
+
+		"""
+		> Single forward run of DALEC-Grass (spinup year included) for a parameter vector 
+		""" 
+
+		return DALEC_GRASS.carbon_model_mod.carbon_model(self.start,self.finish,self.deltat,self.lat,self.met,np.array(pars,order='F'),self.nopools,self.nofluxes,self.version_code,self.nodays,self.nopars,self.nomet)
+
+
+	def check_pars(self,pars) : 
+
+		"""
+		> Parameter constraints checked before the kernel call 
+		> Returns the name of the first constraint the parameters violate (None if all are met)
+		""" 
+
+		if (pars[26]>pars[27]) & (pars[12]<=pars[11]) : return 'pars_management_gsiT'
+		if (pars[21]<=pars[20]) : return 'pars_gsi_vpd'
+		if (pars[19]<=pars[13]) : return 'pars_gsi_photoperiod'
+		if (pars[29]<pars[15:19].sum()) : return 'pars_init_soilC'
+		if (pars[17]>pars[15]+pars[16]+pars[18]) : return 'pars_init_roots'
+		if (pars[7]>pars[6]) : return 'pars_tor_som'
+		return None
+
+
+	def output_constraints(self,pars,lai,gpp,pools,fluxes,rem,Csim,cutsno) : 
+
+		"""
+		> Ecological and dynamic constraints on the outputs of forward runs (spinup year dropped), in the order they are checked 
+		> Outputs of a single run, or of a batch of runs stacked along a first axis (pars (k,nopars), lai (k,noweeks), pools (k,noweeks+1,nopools), ...)
+		> Yields the name of each constraint and whether the run(s) violate it, lazily (a single run stops at its first violation)
+		""" 
+
+		### Math
+		yield 'nan', np.isnan(pools).any(axis=(-2,-1)) | np.isnan(lai).any(axis=-1) | np.isnan(gpp).any(axis=-1) | np.isnan(fluxes).any(axis=(-2,-1))
+		yield 'negative', (pools < 0).any(axis=(-2,-1)) | (fluxes < 0).any(axis=(-2,-1)) | (lai < 0).any(axis=-1)
+		yield 'zero_flux', np.all(fluxes[...,[0,1,2,3,4,5,6,7,8,9,11,12,13,14,15,17,18,19,20]]==0,axis=-2).any(axis=-1)
+		### Fluxes 
+		yield 'gpp_max', (gpp > 25).any(axis=-1)
+		gpp_total = (gpp*7).sum(axis=-1)
+		yield 'gpp_annual_min', gpp_total < 500*self.noyears
+		yield 'gpp_annual_max', gpp_total > 2800*self.noyears
+		reco = fluxes[...,12]+fluxes[...,13]+fluxes[...,2] # autotrophic + litter + SOM respiration 
+		yield 'reco_max', (reco > 20).any(axis=-1)
+		reco_total = (reco*7).sum(axis=-1)
+		yield 'reco_annual_min', reco_total < 500*self.noyears
+		yield 'reco_annual_max', reco_total > 2600*self.noyears
+		### Soil C 
+		yield 'soilC_stable', abs(pars[...,29] - pools[...,-1,5]) > pars[...,29]*0.05
+		### Management
+		yield 'graze_max_LSU', (rem[...,0,:]*21/float(650*0.035) > 70).any(axis=-1) # max total LSU_ha_week
+		yield 'cuts', int(abs(cutsno.sum())) != (Csim>0).sum(axis=-1) # all cuts in inputs are simulated 
+
+
+	def check_outputs(self,pars,lai,gpp,pools,fluxes,rem,Csim,cutsno) : 
+
+		"""
+		> Ecological and dynamic constraints on the outputs of a forward run (spinup year dropped, see output_constraints) 
+		> Returns the name of the first constraint the run violates (None if all are met)
+		""" 
+
+		for name, violated in self.output_constraints(pars,lai,gpp,pools,fluxes,rem,Csim,cutsno) : 
+			if violated : return name
+		return None
+
+
+	def rmse(self,laisim) : 
+
+		"""
+		> LAI RMSE over the valid observations of the reported period, of one run or of a batch of runs (rows) 
+		""" 
+
+		err   = laisim[...,self.firstweek:] - self.obs_lai[:-1]
+		valid = ~np.isnan(err)
+		return np.sqrt((np.where(valid,err,0.)**2).sum(axis=-1) / valid.sum(axis=-1))
+
+
+	def simulation(self,vector):   
+
+		"""
+		> LAI RMSE of a parameter vector, -inf if it violates a constraint (its name is kept in self.rejected) 
+		""" 
+
+		pars = np.array(vector, order='F')
+
+		self.rejected = self.check_pars(pars)
+		if self.rejected is not None : return [-np.inf]
+
+		lai,gpp,nee,pools,fluxes,rem = self.forward(pars)
+
+		## Collect havest outputs 
+		Csim   = rem[1,self.firstweek:] * 0.021  
+		cutsno = np.minimum(self.met[7,self.firstweek:],0) # cut codes (-1) 
+
+		#### Ecological and Dynamic Constrains (spinup year dropped from results)
+		self.rejected = self.check_outputs(pars,lai[52:],gpp[52:],pools[52:,:],fluxes[52:,:],rem[:,52:],Csim,cutsno)
+		if self.rejected is not None : return [-np.inf]
+
+		return [ self.rmse(lai) ]
+
+
+	def simulations(self,X):   
+
+		"""
+		> LAI RMSEs of a batch of parameter vectors (rows of X) : a forward run per vector meeting the parameter constraints, 
+		  then the output constraints and RMSEs of all runs at once 
+		> Returns the array of RMSEs, -inf where a constraint is violated (the names are kept in self.rejections, None where all are met) 
+		""" 
+
+		X = np.asarray(X, dtype=float)
+		rejections = np.array([self.check_pars(pars) for pars in X], dtype=object)
+		rmse = np.zeros(len(X)) - np.inf
+		runs = np.where(np.equal(rejections, None))[0]
+
+		if len(runs) > 0 : 
+			lai,gpp,nee,pools,fluxes,rem = [np.array(out) for out in zip(*[self.forward(X[i]) for i in runs])]
+			Csim   = rem[:,1,self.firstweek:] * 0.021  
+			cutsno = np.minimum(self.met[7,self.firstweek:],0)  
+			ok = np.ones(len(runs), dtype=bool)
+			for name, violated in self.output_constraints(X[runs],lai[:,52:],gpp[:,52:],pools[:,52:,:],fluxes[:,52:,:],rem[:,:,52:],Csim,cutsno) : 
+				rejections[runs[ok & violated]] = name
+				ok &= ~violated
+				if not ok.any() : break
+			rmse[runs[ok]] = self.rmse(lai[ok])
+
+		self.rejections = list(rejections)
+		return rmse
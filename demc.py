@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from spotpy.algorithms import _algorithm
+
+
+class demc(_algorithm) :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Differential Evolution Markov Chain sampler with an archive of past states (DE-MCz) for MDF.run(algorithm='demc')
+	ter Braak C.J.F. & Vrugt J.A. (2008) Differential Evolution Markov Chain with snooker updater and fewer chains,
+	Stat. Comput. 18 ; Vrugt J.A. et al. (2009) Accelerating Markov chain Monte Carlo simulation by differential
+	evolution with self-adaptive randomized subspace sampling, Int. J. Nonlin. Sci. Num. 10
+
+	A few chains are moved one generation at a time : the proposal of a chain adds the scaled difference of two
+	past states drawn from the archive Z (the feasible initial states, then the chain states of every K-th
+	generation) on a random subset of the parameters (crossover probability drawn from CR), with the jump rate
+	2.38/sqrt(2 d') of the d' parameters updated (1 for every 10th proposal, mode jumps of all the parameters), or
+	a snooker update (psnooker of the proposals). With the differences of the current chains, N chains only move
+	within N-1 directions : the archive lets a few chains explore all of them, and the subspace updates keep the
+	proposals within the narrow feasible region of the constraints. The proposals of all chains are evaluated as
+	one batch per generation (dalec_core.simulations with parallel='seq', the spotpy repeater with parallel='mpc'
+	or 'mpi'). The run stops as soon as the chains have converged (split R-hat < rhat_limit and effective sample
+	size > ess_min for all parameters, on the 2nd half of the chains) or after repetitions model evaluations
+
+	> With checkpoint_every, the population, archive and chain history are checkpointed (see checkpoint.py) after the
+	  generations, and a killed run continues from its last checkpoint with sample(..., resume=state)
+
+	> Likelihood : Gaussian LAI errors with the error sigma integrated out (Jeffreys prior), log L = -neff * log(RMSE),
+	  or, for a given LAI observation error sigma, log L = -0.5 * neff * (RMSE/sigma)^2. The weekly LAI retrievals
+	  are autocorrelated, so neff is the effective number of independent observations nobs (1-r1)/(1+r1), r1 the
+	  lag-1 autocorrelation of the observations. The database keeps the MDF objective (like1 = -RMSE) of the chain
+	  states of every generation (chain column = chain id)
+	---------------------------------------------------------------------------------
+	"""
+
+	def __init__(self, *args, **kwargs):
+
+		kwargs['optimization_direction'] = 'maximize'
+		kwargs['algorithm_name'] = 'Differential Evolution Markov Chain (DE-MCz) sampler'
+		self.batch = kwargs.get('parallel', 'seq') == 'seq' # batches evaluated by dalec_core.simulations
+		super(demc, self).__init__(*args, **kwargs)
+
+
+	def loglike(self, simulation):
+		rmse = simulation[0]
+		if not np.isfinite(rmse) : return -np.inf
+		if self.sigma is None : return -self.neff * np.log(rmse)
+		return -0.5 * self.neff * (rmse/self.sigma)**2
+
+
+	def evaluate(self, X, ids):
+
+		"""
+		> Evaluates a batch of parameter vectors (rows ids of X) in one pass, or through the spotpy repeater (parallel runs)
+		> Returns the log-likelihoods, the MDF objectives (-RMSE) and the simulations
+		"""
+
+		ids = list(ids)
+		logp = np.zeros(len(X)) - np.inf
+		likes = np.zeros(len(X)) - np.inf
+		sims = [None] * len(X)
+		if self.batch : runs = zip(ids, X[ids], [[rmse] for rmse in self.setup.simulations(X[ids])])
+		else : runs = self.repeat((i, X[i]) for i in ids)
+		for i, params, simulation in runs:
+			likes[i] = self.postprocessing(self.status.rep + 1, params, simulation, save_run=False)
+			logp[i] = self.loglike(simulation)
+			sims[i] = simulation
+		return logp, likes, sims
+
+
+	def initial_population(self, N, init, lo, hi, M0, budget):
+
+		"""
+		> Feasible initial chains and archive : the chains start from the best rows of init (array or csv of a previous MDF
+		  run, also the initial archive) and prior draws (batches of up to 100) until every chain has a feasible start,
+		  then prior draws continue until the archive holds M0 feasible states or budget model evaluations are used
+		> Returns the chain states, their log-likelihoods, MDF objectives and simulations, and the initial archive
+		"""
+
+		d = len(lo)
+		if init is None : init = np.zeros((0,d))
+		elif isinstance(init, str) :
+			import pandas as pd
+			outs = pd.read_csv(init)
+			outs = outs[np.isfinite(outs.like1.astype(float))].sort_values(by='like1', ascending=False)
+			init = np.array(outs[[c for c in outs.columns if c.startswith('par')]])
+		init = np.array(init, dtype=float)
+
+		X, logp, likes, sims = np.zeros((N,d)), np.zeros(N) - np.inf, np.zeros(N) - np.inf, [None] * N
+		archive, found, used = [init], 0, 0
+		Y = init[:N]
+		while True :
+			drawn = len(Y) == 0
+			if len(Y) == 0 : Y = np.random.uniform(lo, hi, (max(1, min(100, self.status.repetitions - self.status.rep)), d))
+			logp_y, likes_y, sims_y = self.evaluate(Y, range(len(Y)))
+			used += len(Y)
+			feasible = np.where(np.isfinite(logp_y))[0]
+			for j in feasible[:N-found]:
+				X[found], logp[found], likes[found], sims[found] = Y[j], logp_y[j], likes_y[j], sims_y[j]
+				found += 1
+			if drawn : archive.append(Y[feasible])
+			if (found == N) and ((sum(len(z) for z in archive) >= M0) or (used >= budget) or self.status.stop) : break
+			if self.status.stop :
+				raise RuntimeError('DE-MC : %i feasible initial states of %i chains after %i evaluations (all the repetitions), '
+								   'increase repetitions or give an init population' %(found, N, used))
+			Y = np.zeros((0,d))
+
+		Z = np.vstack(archive + [X])
+		print('DE-MC : %i chains and an archive of %i feasible states after %i evaluations' %(N, len(Z), used))
+		return X, logp, likes, sims, Z
+
+
+	def sample(self, repetitions, nChains=6, rhat_limit=1.1, ess_min=50, sigma=None, check_every=100, init=None, eps=1e-4, CR=(0.05,0.1,0.2), psnooker=0.1, K=10, M0=None, init_fraction=0.1, checkpoint_every=None, resume=None):
+
+		"""
+		> repetitions (int)   : maximum number of model evaluations
+		> nChains (int)       : number of chains
+		> rhat_limit (float)  : split R-hat below which all parameters are converged
+		> ess_min (float)     : minimum effective sample size of every parameter (50 : the slowest parameters of the
+		                        greatfield posterior plateau around 50-100 effective samples over millions of evaluations)
+		> sigma (float)       : LAI observation error (m2.m-2) of the Gaussian likelihood (None = integrated out)
+		> check_every (int)   : generations between two convergence checks
+		> init (str / array)  : initial population and archive (csv of a previous MDF run or array), default prior draws
+		> eps (float)         : random jitter of the proposals (fraction of the prior range)
+		> CR (tuple)          : crossover probabilities (fraction of the parameters updated by a proposal)
+		> psnooker (float)    : fraction of snooker updates
+		> K (int)             : generations between two additions of the chain states to the archive
+		> M0 (int)            : feasible states of the initial archive drawn from the prior (default number of parameters)
+		> init_fraction (float) : maximum fraction of repetitions spent on the initial archive (the chains keep drawing
+		                        from the prior until they all have a feasible start)
+		> checkpoint_every (float) : seconds between two checkpoints (None = no checkpoints)
+		> resume (dict)       : state of the checkpoint to continue from (checkpoint.load)
+		"""
+
+		import checkpoint
+
+		self.set_repetiton(repetitions)
+		self.sigma = sigma
+		self.neff  = effective_obs(self.setup.obs_lai[:-1])
+		print('Starting the DE-MC algorithm with %i repetitions...' %repetitions)
+
+		lo, hi = self.parameter()['minbound'], self.parameter()['maxbound']
+		d = len(lo)
+		CR = np.array(CR, dtype=float)
+
+		if resume is None :
+			X, logp, likes, sims, Z = self.initial_population(nChains, init, lo, hi, d if M0 is None else M0, int(init_fraction * repetitions))
+			M = len(Z)
+			self.rhat, self.ess, self.acceptance = [], [], []
+			self.stop_reason = 'repetitions'
+			history = [X.copy()]
+			logp_hist = []
+			thin, gen = 1, 0
+		else :
+			checkpoint.restore(self, resume)
+			X, logp, likes, sims, Z, K, history, logp_hist, thin, gen = [resume[k] for k in ['X','logp','likes','sims','Z','K','history','logp_hist','thin','gen']]
+			self.rhat, self.ess, self.acceptance, self.stop_reason = resume['rhat'], resume['ess'], resume['acceptance'], resume['stop_reason']
+			M = len(Z)
+		N = len(X)
+
+		def state(finished):
+			return {'X': X, 'logp': logp, 'likes': likes, 'sims': sims, 'Z': Z[:M], 'K': K, 'history': history, 'logp_hist': logp_hist,
+					'thin': thin, 'gen': gen, 'rhat': self.rhat, 'ess': self.ess, 'acceptance': self.acceptance, 'stop_reason': self.stop_reason,
+					'finished': finished}
+
+		accepted = 0
+
+		while (not self.status.stop) and not (resume or {}).get('finished') :
+			gen += 1
+
+			## proposals : x_i + gamma (z_r1 - z_r2) + e on a random subset of the parameters (at least one), z_r1 != z_r2 archive
+			## states ; the mode jumps (gamma = 1) move all the parameters
+			r1 = np.random.randint(M, size=N)
+			r2 = (r1 + 1 + np.random.randint(M-1, size=N)) % M
+			update = np.random.rand(N,d) < CR[np.random.randint(len(CR), size=N)][:,None]
+			update[np.arange(N), np.random.randint(d, size=N)] = True
+			g = 2.38 / np.sqrt(2*update.sum(axis=1))
+			jump = np.random.rand(N) < 0.1
+			g[jump], update[jump] = 1., True
+			Xp = X + update*(g[:,None]*(Z[r1] - Z[r2]) + np.random.uniform(-eps, eps, (N,d))*(hi - lo))
+
+			## snooker updates : along the line through x_i and an archive state z, by the difference of the projections of z_r1 and
+			## z_r2 on it (gamma uniform in [1.2,2.2]), with the ratio of the distances to z in the acceptance probability
+			snooker = np.where(np.random.rand(N) < psnooker)[0]
+			z = Z[np.random.randint(M, size=len(snooker))]
+			e = X[snooker] - z
+			ee = np.maximum((e*e).sum(axis=1), 1e-300)
+			Xp[snooker] = X[snooker] + (np.random.uniform(1.2, 2.2, len(snooker)) * ((Z[r1[snooker]] - Z[r2[snooker]])*e).sum(axis=1) / ee)[:,None] * e
+			Xp = reflect(Xp, lo, hi)
+			logJ = np.zeros(N)
+			logJ[snooker] = 0.5*(d-1) * np.log(np.maximum(((Xp[snooker] - z)**2).sum(axis=1), 1e-300) / ee)
+
+			logp_p, likes_p, sims_p = self.evaluate(Xp, range(N))
+
+			## Metropolis acceptance
+			accept = np.log(np.random.rand(N)) < logp_p - logp + logJ
+			accepted += accept.sum()
+			X[accept], logp[accept], likes[accept] = Xp[accept], logp_p[accept], likes_p[accept]
+			for i in np.where(accept)[0]: sims[i] = sims_p[i]
+			for i in range(N): self.save(likes[i], X[i], sims[i], chains=i)
+
+			## archive of the chain states (grown by doubling, thinned by 2 with K doubled whenever it gets long, to bound the memory)
+			if gen % K == 0 :
+				if M + N > len(Z) : Z = np.vstack([Z, np.zeros((len(Z) + N, d))])
+				Z[M:M+N] = X
+				M += N
+				if M > 100000 :
+					Z, K = Z[:M:2].copy(), 2*K
+					M = len(Z)
+
+			## keep the chain states (thinned by 2 whenever the history gets long, to bound the memory)
+			if gen % thin == 0 : history.append(X.copy())
+			if len(history) > 4000 :
+				history = history[::2]
+				thin *= 2
+
+			if gen % check_every == 0 :
+				rhat, ess = convergence(np.array(history[len(history)//2:]))
+				self.rhat.append(rhat.max())
+				self.ess.append(ess.min())
+				self.acceptance.append(accepted / float(N*check_every))
+				accepted = 0
+				print('generation %i : max R-hat %.3f, min ESS %.0f, acceptance %.3f' %(gen, rhat.max(), ess.min(), self.acceptance[-1]))
+				if (rhat.max() < rhat_limit) and (ess.min() >= ess_min) :
+					self.stop_reason = 'converged'
+					break
+
+				## burn-in : chains stuck far below the others (outliers of the mean log-likelihood) restart from the
+				## current state of randomly drawn other chains (not all from the best one, which would collapse the population)
+				if rhat.max() >= rhat_limit :
+					logp_hist.append(logp.copy())
+					mean_logp = np.mean(logp_hist[len(logp_hist)//2:], axis=0)
+					q1, q3 = np.percentile(mean_logp, [25,75])
+					outliers = np.where(mean_logp < q1 - 2*(q3 - q1))[0]
+					if len(outliers) > 0 :
+						donors = np.random.choice(np.setdiff1d(np.arange(N), outliers), len(outliers))
+						X[outliers], logp[outliers], likes[outliers] = X[donors], logp[donors], likes[donors]
+						for i, j in zip(outliers, donors): sims[i] = sims[j]
+						logp_hist = []
+
+			if checkpoint.due(self, checkpoint_every) : checkpoint.save(self, state(False))
+
+		print('DE-MC stopped (%s) after %i generations' %(self.stop_reason, gen))
+		if gen == 0 : raise RuntimeError('DE-MC : no generation ran (%i repetitions, %i chains)' %(repetitions, N))
+		if checkpoint_every is not None : checkpoint.save(self, state(True))
+		self.final_call()
+
+
+
+def effective_obs(obs):
+
+	"""
+	> Effective number of independent observations of an autocorrelated series, n (1-r1)/(1+r1) (r1 the lag-1
+	  autocorrelation over consecutive valid observations, an AR(1) approximation), at least 1
+	"""
+
+	obs = np.asarray(obs, dtype=float)
+	obs = obs[np.isfinite(obs)]
+	n = len(obs)
+	if n < 3 : return float(max(n, 1))
+	a = obs - obs.mean()
+	r1 = np.sum(a[:-1]*a[1:]) / np.sum(a*a) if np.any(a != 0) else 0.
+	r1 = min(max(r1, 0.), 0.99)
+	return float(max(1., n * (1-r1) / (1+r1)))
+
+
+
+def reflect(X, lo, hi):
+
+	"""
+	> Reflects proposals back into the prior bounds (symmetric, keeps the uniform priors' detailed balance)
+	"""
+
+	X = np.where(X < lo, 2*lo - X, X)
+	X = np.where(X > hi, 2*hi - X, X)
+	return np.clip(X, lo, hi)
+
+
+
+def convergence(chains):
+
+	"""
+	> Split R-hat and effective sample size of each parameter (Gelman et al. 2013, BDA3 11.4-11.5) : the chains are
+	  split in halves, so that a chain still drifting within the window is not converged
+	> chains : array (iterations, chains, parameters)
+	"""
+
+	n = len(chains) // 2
+	if n < 4 : return np.zeros(chains.shape[2]) + np.inf, np.zeros(chains.shape[2])
+	chains = np.concatenate([chains[:n], chains[n:2*n]], axis=1)
+	n, m, d = chains.shape
+
+	means = chains.mean(axis=0)
+	W = chains.var(axis=0, ddof=1).mean(axis=0)
+	B = n * means.var(axis=0, ddof=1)
+	var = (n-1)/float(n) * W + B/float(n)
+	with np.errstate(divide='ignore', invalid='ignore') :
+		rhat = np.sqrt(var / W)
+
+	## mean within-chain autocovariances (FFT) -> autocorrelations, summed over pairs of lags while positive (Geyer)
+	x = chains - means
+	f = np.fft.rfft(x, n=2*n, axis=0)
+	acov = np.fft.irfft(f * np.conjugate(f), axis=0)[:n].mean(axis=1) / n
+	with np.errstate(divide='ignore', invalid='ignore') :
+		rho = 1. - (W - acov) / var
+	rho[0] = 1.
+	pairs = rho[:2*(n//2)].reshape(n//2, 2, d).sum(axis=1)
+	first_negative = np.where((pairs < 0).any(axis=0), np.argmax(pairs < 0, axis=0), n//2)
+	tau = np.array([-1. + 2.*pairs[:first_negative[k],k].sum() for k in range(d)])
+	ess = m*n / np.maximum(tau, 1./np.log10(max(m*n,10)))
+	return np.nan_to_num(rhat, nan=np.inf), np.nan_to_num(ess, nan=0.)
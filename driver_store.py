@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import numpy as np
+import h5py
+
+
+class DriverStore() :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Multi-site driver and observation store
+	One HDF5 file holding the DALEC-Grass inputs of many sites, keyed by site ID :
+	/<site>/met      : drivers (14,weeks) | chunked per site
+	/<site>/obs_lai  : LAI observations (weeks)
+	/<site>/dates    : weekly date axis (days since 1970-01-01)
+	/<site>.attrs    : lat, lon (centroid)
+	A site's arrays are read by key (O(1) group lookup), and any number of processes
+	can read the store at the same time (each process opens its own read-only handle)
+
+	> User inputs
+	storeloc (str) : location of the .h5 store
+	mode (str)     : 'r' (read, default) or 'a' (read/write)
+	---------------------------------------------------------------------------------
+	"""
+
+	def __init__(self, storeloc, mode='r'):
+
+		self.storeloc = storeloc
+		self.mode     = mode
+		self._h5      = None
+		self._pid     = None
+
+
+	@property
+	def h5(self):
+		## re-open after a fork, HDF5 handles can not be shared between processes
+		if (self._h5 is None) or (self._pid != os.getpid()) :
+			if self.mode == 'r' : self._h5 = h5py.File(self.storeloc, 'r', swmr=True)
+			else : self._h5 = h5py.File(self.storeloc, self.mode, libver='latest')
+			self._pid = os.getpid()
+		return self._h5
+
+
+	def __getstate__(self):
+		## sent to a worker process : the HDF5 handle is re-opened there
+		state = dict(self.__dict__)
+		state['_h5'] = None
+		return state
+
+
+	def __contains__(self, site):
+		return site in self.h5
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *args):
+		self.close()
+
+
+	def close(self):
+		if self._h5 is not None : self._h5.close()
+		self._h5 = None
+
+
+	def sites(self):
+		return list(self.h5.keys())
+
+
+	def put(self, site, met, obs_lai, lat=np.nan, lon=np.nan, dates=None):
+
+		"""
+		> Adds (or replaces) the drivers, LAI observations, centroid and date axis of a site
+		> dates : weekly dates of the drivers (anything np.datetime64 can parse)
+		"""
+
+		if site in self.h5 : del self.h5[site]
+		grp = self.h5.create_group(site)
+		grp.create_dataset('met', data=np.asarray(met,dtype='f8'), chunks=np.shape(met))
+		grp.create_dataset('obs_lai', data=np.asarray(obs_lai,dtype='f8'))
+		if dates is not None :
+			grp.create_dataset('dates', data=np.array(dates,dtype='datetime64[D]').astype('i8'))
+		grp.attrs['lat'] = lat
+		grp.attrs['lon'] = lon
+		self.h5.flush()
+
+
+	def get(self, site):
+
+		"""
+		> Returns a dict with the met, obs_lai, lat, lon and dates (or None) of a site
+		"""
+
+		grp = self.h5[site]
+		out = {'met': grp['met'][()],
+			   'obs_lai': grp['obs_lai'][()],
+			   'lat': float(grp.attrs['lat']),
+			   'lon': float(grp.attrs['lon']),
+			   'dates': None}
+		if 'dates' in grp : out['dates'] = grp['dates'][()].astype('datetime64[D]')
+		return out
+
+
+	def centroids(self):
+
+		"""
+		> Returns {site : (lat, lon)} for all sites in the store
+		"""
+
+		return dict((s, (float(self.h5[s].attrs['lat']), float(self.h5[s].attrs['lon']))) for s in self.h5)
+
+
+	def import_npy(self, datadir, lat=np.nan, lon=np.nan):
+
+		"""
+		> Adds all <site>_M.npy / <site>_O.npy pairs of a directory to the store
+		"""
+
+		for metloc in sorted(glob.glob('%s/*_M.npy' %datadir)):
+			site = os.path.basename(metloc)[:-len('_M.npy')]
+			if not os.path.exists('%s/%s_O.npy' %(datadir,site)) : continue
+			self.put(site, np.load(metloc), np.load('%s/%s_O.npy' %(datadir,site)), lat=lat, lon=lon)
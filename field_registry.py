@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+from shapely.geometry import shape, box, Polygon
+from shapely.strtree import STRtree
+
+
+class FieldRegistry() :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Registry of many field polygons with an R-tree (STR packed) spatial index
+	Maps the footprint of a Sentinel-1 frame / Sentinel-2 tile to all the fields it intersects, so
+	that neighbouring fields sharing a scene query, download, process and read it only once, and
+	extracts the per-field (or per box/subfield, see boxes) statistics of a raster in a single pass
+
+	> User inputs
+	fields (dict) : {field name : shapely geometry (lon/lat, EPSG:4326)}
+	---------------------------------------------------------------------------------
+	"""
+
+	def __init__(self, fields=None):
+
+		self.names      = []
+		self.geometries = []
+		self._tree      = None
+		for name, geometry in (fields or {}).items() : self.add(name, geometry)
+
+
+	@classmethod
+	def from_geojson(cls, jsonlocs):
+
+		"""
+		> Builds the registry from field geojson files (field name = file name, as in IDP.fieldname)
+		"""
+
+		fields = {}
+		for jsonloc in jsonlocs:
+			with open(jsonloc) as f: js = json.load(f)
+			for feature in js['features']: polygon = shape(feature['geometry'])
+			fields[os.path.splitext(os.path.basename(jsonloc))[0]] = polygon
+		return cls(fields)
+
+
+	def __len__(self):
+		return len(self.names)
+
+
+	def add(self, name, geometry):
+
+		if name in self.names : raise ValueError('field %s is already registered' %name)
+		self.names.append(name)
+		self.geometries.append(geometry)
+		self._tree = None # rebuilt on the next query
+
+
+	@property
+	def tree(self):
+		if self._tree is None : self._tree = STRtree(self.geometries)
+		return self._tree
+
+
+	def geometry(self, name):
+		return self.geometries[self.names.index(name)]
+
+
+	def extent(self, names=None):
+
+		"""
+		> Returns the bounding box (polygon) of all (or some) fields, i.e. the one area to query the archives for
+		"""
+
+		geometries = self.geometries if names is None else [self.geometry(n) for n in names]
+		minx = min(g.bounds[0] for g in geometries)
+		miny = min(g.bounds[1] for g in geometries)
+		maxx = max(g.bounds[2] for g in geometries)
+		maxy = max(g.bounds[3] for g in geometries)
+		return box(minx, miny, maxx, maxy)
+
+
+	def query(self, footprint):
+
+		"""
+		> Returns the names of the fields intersecting a footprint (shapely geometry or WKT)
+		"""
+
+		if isinstance(footprint, str) :
+			from shapely import wkt
+			footprint = wkt.loads(footprint)
+		return [self.names[i] for i in sorted(self.tree.query(footprint, predicate='intersects'))]
+
+
+	def fan_out(self, footprints):
+
+		"""
+		> Maps scenes to fields
+		> footprints (dict) : {scene id : footprint (shapely geometry or WKT)}
+		> Returns {scene id : [field names]} for the scenes intersecting at least one field
+		"""
+
+		out = {}
+		for scene, footprint in footprints.items():
+			fields = self.query(footprint)
+			if len(fields) > 0 : out[scene] = fields
+		return out
+
+
+	def boxes(self, split, names=None):
+
+		"""
+		> Registry of the boxes/subfields of all (or some) fields (see split_boxes), named <field>:<box number>
+		"""
+
+		boxes = {}
+		for name in (names or self.names):
+			for k, (i, j, b) in enumerate(split_boxes(self.geometry(name), split)): boxes['%s:%i' %(name,k)] = b
+		return FieldRegistry(boxes)
+
+
+	def zonal_stats(self, raster, names=None, stats=['mean','std','count'], band=1, nodata=0):
+
+		"""
+		> Per-field statistics of one raster in a single pass (the raster is opened once for all fields)
+		> Only fields intersecting the raster bounds are read
+		> Returns {field name : {stat : value}}
+		"""
+
+		import rasterio
+		import rasterstats
+
+		with rasterio.open(raster) as src : bounds = box(*src.bounds)
+		fields = self.query(bounds)
+		if names is not None : fields = [n for n in fields if n in names]
+		if len(fields) == 0 : return {}
+
+		zones = rasterstats.zonal_stats([self.geometry(n) for n in fields], raster, stats=stats, band=band, nodata=nodata)
+		return dict(zip(fields, zones))
+
+
+
+def asf_footprint(row):
+
+	"""
+	> Footprint polygon of a S1 frame from the corner coordinates of an ASF search (csv) result row
+	"""
+
+	corners = ['Near Start','Far Start','Far End','Near End']
+	return Polygon([(float(row['%s Lon' %c]), float(row['%s Lat' %c])) for c in corners])
+
+
+
+def split_boxes(geometry, split):
+
+	"""
+	> Splits the bounding box of a field into split[0] x split[1] boxes/subfields (same boxes and order as sentinelhub's BBoxSplitter)
+	> Returns [(index_x, index_y, box)] of the boxes intersecting the field
+	"""
+
+	minx, miny, maxx, maxy = geometry.bounds
+	dx, dy = (maxx - minx) / split[0], (maxy - miny) / split[1]
+	out = []
+	for i in range(split[0]):
+		for j in range(split[1]):
+			b = box(minx + i*dx, miny + j*dy, minx + (i+1)*dx, miny + (j+1)*dy)
+			if geometry.intersects(b) : out.append((i, j, b))
+	return out
+
+
+
+def box_stats(registry, raster, bands=(1,), stats=('mean','std','count'), nodata=0):
+
+	"""
+	> Per box statistics of one raster for all the boxes of a registry (see FieldRegistry.boxes), one pass per band
+	> Returns a DataFrame (field, box, <stat>_<band>) with one row per box intersecting the raster
+	"""
+
+	import pandas as pd
+
+	rows = {}
+	for band in bands:
+		for name, zone in registry.zonal_stats(raster, stats=list(stats), band=band, nodata=nodata).items():
+			field, k = name.rsplit(':', 1)
+			row = rows.setdefault(name, {'field': field, 'box': int(k)})
+			for stat in stats: row['%s_%i' %(stat,band)] = zone[stat]
+	return pd.DataFrame(list(rows.values()), columns=['field','box'] + ['%s_%i' %(stat,band) for band in bands for stat in stats])
+
+
+
+def boxstatsfile(raster, split):
+
+	"""
+	> Location of the per box statistics table of a raster (written next to it by the pipeline's per scene stage)
+	"""
+
+	return '%s_boxes_%ix%i.csv' %(os.path.splitext(raster)[0], split[0], split[1])
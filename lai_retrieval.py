@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import os
+import datetime
+import numpy as np
+import pandas as pd
+import joblib
+import sklearn
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import train_test_split
+
+
+class LAI_RF() :
+
+	"""
+	---------------------------------------------------------------------------------
+	> S1 (VV/VH) to LAI random forest retrieval model
+	Trained once per S2 tile / region on the S1+S2 box/subfield data, saved to disk together
+	with its feature schema and training metadata, loaded lazily on first use and used to
+	predict LAI for many fields in one batched call
+
+	> User inputs
+	modelloc (str)     : location of the saved model (e.g. <workingdir>/lai_rf_T30UVB.joblib)
+	n_estimators (int) : number of trees
+	n_jobs (int)       : number of parallel jobs for training/prediction (-1 = all cpus)
+	---------------------------------------------------------------------------------
+	"""
+
+	features = ['band1','band2','DOY','vpd']
+
+	def __init__(self, modelloc, n_estimators=100, n_jobs=-1):
+
+		self.modelloc     = modelloc
+		self.n_estimators = n_estimators
+		self.n_jobs       = n_jobs
+		self.metadata     = None
+		self._rf          = None
+
+
+	@property
+	def rf(self):
+		if self._rf is None : self.load()
+		return self._rf
+
+
+	def exists(self):
+		return (self._rf is not None) or os.path.exists(self.modelloc)
+
+
+	def train(self, DF, region=None, test_size=0.2, random_state=0):
+
+		"""
+		> Trains the RF on a dataframe with the feature columns and the S2 LAI (lai) and saves it
+		> DF can hold the box/subfield data of one or many fields (one training per tile/region)
+		"""
+
+		DF = DF.dropna(subset=self.features+['lai'])
+		X_train, X_test, y_train, y_test = train_test_split( DF[self.features], DF.lai, test_size=test_size,random_state=random_state)
+		self._rf = RandomForestRegressor(n_estimators=self.n_estimators, n_jobs=self.n_jobs, random_state=random_state)
+		self._rf.fit(X_train, y_train)
+
+		self.metadata = {'region': region,
+						 'features': list(self.features),
+						 'n_estimators': self.n_estimators,
+						 'n_train': len(X_train),
+						 'n_test': len(X_test),
+						 'score': float(self._rf.score(X_test, y_test)),
+						 'dates': [str(DF.index.min())[:10], str(DF.index.max())[:10]],
+						 'sklearn': sklearn.__version__,
+						 'created': datetime.datetime.now().isoformat()}
+
+		self.save()
+		return self.metadata['score']
+
+
+	def train_once(self, frames, region=None, **kwargs):
+
+		"""
+		> Trains and saves the model on the pooled data of many fields unless it already exists (checked
+		  under a lock on <modelloc>.lock, so that the fields of a tile/region racing for it train it only once)
+		> frames : list of training dataframes (see IDP.LAI_training_data), or a callable returning it (only
+		           called when the model has to be trained)
+		> Returns the test score, None if the model already existed
+		"""
+
+		import fcntl
+
+		os.makedirs(os.path.dirname(os.path.abspath(self.modelloc)), exist_ok=True)
+		with open(self.modelloc + '.lock','w') as lock :
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				if self.exists() :
+					if self._rf is None : self.load()
+					return None
+				if callable(frames) : frames = frames()
+				return self.train(pd.concat(frames), region=region, **kwargs)
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+	def save(self):
+
+		"""
+		> Saves the model, its feature schema and training metadata in one file (atomic replace)
+		"""
+
+		os.makedirs(os.path.dirname(os.path.abspath(self.modelloc)), exist_ok=True)
+		joblib.dump({'rf': self._rf, 'features': list(self.features), 'metadata': self.metadata}, self.modelloc + '.tmp')
+		os.replace(self.modelloc + '.tmp', self.modelloc)
+
+
+	def load(self):
+
+		saved = joblib.load(self.modelloc)
+		if list(saved['features']) != list(self.features) :
+			raise ValueError('%s was trained on features %s, expected %s' %(self.modelloc,saved['features'],self.features))
+		self._rf = saved['rf']
+		self._rf.set_params(n_jobs=self.n_jobs)
+		self.metadata = saved['metadata']
+
+
+	def predict(self, DF):
+
+		"""
+		> Predicts LAI for one dataframe holding the feature columns
+		"""
+
+		return self.rf.predict(DF[self.features])
+
+
+	def predict_fields(self, fields):
+
+		"""
+		> Predicts LAI for many fields' S1 time series in one batched call
+		> fields (dict) : {field name : dataframe with the feature columns}
+		> Returns {field name : pd.Series of predicted LAI} (same index as the input dataframes)
+		"""
+
+		names = list(fields.keys())
+		sizes = [len(fields[n]) for n in names]
+		X = pd.concat([fields[n][self.features] for n in names])
+		lai = self.rf.predict(X)
+
+		out = {}
+		for n, i, j in zip(names, np.cumsum([0]+sizes[:-1]), np.cumsum(sizes)):
+			out[n] = pd.Series(lai[i:j], index=fields[n].index)
+		return out
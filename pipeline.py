@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------------
+> Streaming pipeline
+Runs the input data production (IDP) and model-data fusion (MDF) of many fields as one
+dependency graph of small tasks (per scene / per year / per field) instead of whole batch stages :
+
+  s1_query:<F>  -> s1_download:<F>:<scene> -> s1_process:<F>:<scene> --\\
+  s2_query:<F>  -> s2_download:<F>:<scene> -> s2_process:<F>:<scene> ---> drivers:<F> -> calibrate:<F>
+  era5:<F>:<year> -----------------------------------------------------/
+                                          lai_rf:<tile/region> -------/
+
+The S1->LAI random forest of a tile/region is trained once, on the pooled box/subfield data of all its
+fields (lai_rf task, after all their scenes and ERA5 years), and every field's drivers use it.
+
+A scene is processed as soon as it is downloaded, and a field is calibrated as soon as its own
+drivers are ready. Every stage has its own bounded worker pool (network, SNAP/GDAL and CPU bound
+stages do not starve each other) and completed tasks are recorded in a JSON state file, so a
+restarted pipeline skips everything that is already done and retries only what failed
+
+> Usage
+pipe = pipeline.run([IDP(...), IDP(...)], '<workingdir>/pipeline_state.json', repetitions=...)
+---------------------------------------------------------------------------------
+"""
+
+import os
+import json
+import time
+import datetime
+import functools
+import concurrent.futures
+import numpy as np
+
+
+default_workers = {'download': 4, 'process': 2, 'drivers': 2, 'calibrate': 2} # default pool size per stage
+process_stages = ['drivers','calibrate'] # stages run in worker processes (the others in threads)
+
+
+class Pipeline() :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Dependency graph of tasks executed over bounded per-stage pools
+
+	> User inputs
+	statefile (str) : location of the JSON file recording completed/failed tasks
+	workers (dict)  : {stage : pool size} (defaults in pipeline.default_workers)
+	---------------------------------------------------------------------------------
+	"""
+
+	def __init__(self, statefile, workers=None):
+
+		self.statefile = statefile
+		self.workers   = dict(default_workers, **(workers or {}))
+		self.tasks     = {}  # key : [stage, func, args, deps, then]
+		self.done      = {}  # key : result (kept for tasks with a callback)
+		self.failed    = {}  # key : error message
+		self.timings   = {}  # key : seconds
+
+		if os.path.exists(statefile) :
+			with open(statefile) as f : state = json.load(f)
+			self.done = state['done']
+
+
+	def add(self, key, stage, func, args=(), deps=(), then=None):
+
+		"""
+		> Adds a task (once, keys are unique) running func(*args) in the pool of stage after all deps
+		> then (callable) : then(pipeline, result) is called in the main thread when the task is done
+		                    (e.g. to add per scene tasks once a query returns) ; for tasks completed in
+		                    a previous run it is called straight away with the recorded result
+		"""
+
+		if key in self.tasks : return
+		self.tasks[key] = [stage, func, args, list(deps), then]
+		if (key in self.done) and (then is not None) : then(self, self.done[key])
+
+
+	def depend(self, key, *deps):
+
+		"""
+		> Adds dependencies to an existing task (e.g. a field's drivers on its dynamically added scenes)
+		"""
+
+		self.tasks[key][3].extend(d for d in deps if d not in self.tasks[key][3])
+
+
+	def save(self):
+
+		"""
+		> Writes the state file (atomic replace)
+		"""
+
+		state = {'done': self.done, 'failed': self.failed, 'timings': self.timings,
+				 'updated': datetime.datetime.now().isoformat()}
+		with open(self.statefile + '.tmp','w') as f : json.dump(state, f, indent=1, default=str)
+		os.replace(self.statefile + '.tmp', self.statefile)
+
+
+	def run(self):
+
+		"""
+		> Runs all tasks that are not done yet, streaming each one to its pool as soon as its dependencies are met
+		> Tasks depending on a failed task are skipped (and retried in the next run)
+		> Returns the dict of failed tasks {key : error}
+		"""
+
+		pools = {}
+		for stage, n in self.workers.items():
+			if stage in process_stages : pools[stage] = concurrent.futures.ProcessPoolExecutor(n)
+			else : pools[stage] = concurrent.futures.ThreadPoolExecutor(n)
+
+		self.failed = {}
+		running = {}
+		try:
+			while True :
+
+				## submit every task whose dependencies are done
+				for key, (stage, func, args, deps, then) in list(self.tasks.items()):
+					if (key in self.done) or (key in self.failed) or (key in running.values()) : continue
+					if any(d in self.failed for d in deps) :
+						self.failed[key] = 'skipped (dependency failed)'
+					elif all(d in self.done for d in deps) :
+						running[pools[stage].submit(func, *args)] = key
+						self.timings[key] = time.time()
+
+				if len(running) == 0 : break
+
+				finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in finished:
+					key = running.pop(future)
+					self.timings[key] = time.time() - self.timings[key]
+					try:
+						result = future.result()
+					except Exception as e :
+						self.failed[key] = repr(e)
+						print ('%s failed : %r' %(key,e))
+					else :
+						then = self.tasks[key][4]
+						self.done[key] = result if then is not None else None
+						if then is not None :
+							try:
+								then(self, result)
+							except Exception as e :
+								del self.done[key]
+								self.failed[key] = repr(e)
+								print ('%s failed : %r' %(key,e))
+					self.save()
+
+			## tasks left waiting on unknown keys
+			for key in self.tasks:
+				if (key not in self.done) and (key not in self.failed) : self.failed[key] = 'skipped (unknown dependency)'
+			self.save()
+
+		finally:
+			for pool in pools.values() : pool.shutdown(wait=True, cancel_futures=True)
+
+		return self.failed
+
+
+
+### ---------------------------------------------------------------------------------
+### IDP / MDF tasks (module level so they can be sent to worker processes)
+
+def s1_query(idp) :
+	return [str(url) for url in idp.ASF_query().URL]
+
+
+def s2_query(idp) :
+	return [str(tile_id) for tile_id in idp.AWS_query().productIdentifier]
+
+
+def s1_process(idp, url) :
+	idp.S1_scene_to_VVVH(os.path.basename(url))
+
+
+def s2_process(idp, tile_id) :
+	## AWS_download_scene saves the product as <tile_id>.SAFE
+	idp.S2_scene_to_LAI('%s.SAFE' %tile_id)
+
+
+def calibrate_field(idp, mdf_kwargs) :
+
+	import MDF
+
+	inputs = '%s/DALEC_Grass/inputs' %idp.workingdir
+	MDF.run(inputs, idp.fieldname,
+			met=np.load('%s/met_%s.npy' %(inputs,idp.fieldname)),
+			obs_lai=np.load('%s/lai_obs_%s.npy' %(inputs,idp.fieldname)),
+			**mdf_kwargs)
+
+
+def link(src, dstdir) :
+	## make a shared (region) product visible in a field's own data directory
+	os.makedirs(dstdir, exist_ok=True)
+	dst = '%s/%s' %(dstdir,os.path.basename(src))
+	if not os.path.lexists(dst) : os.symlink(os.path.abspath(src), dst)
+
+
+def s1_region_query(region) :
+	from field_registry import asf_footprint
+	S1_data = region.ASF_query()
+	return [[str(S1_data.URL.iloc[i]), asf_footprint(S1_data.iloc[i]).wkt] for i in range(len(S1_data))]
+
+
+def s2_region_query(region) :
+	datainfo = region.AWS_query()
+	return [[str(tile_id), str(footprint)] for tile_id, footprint in zip(datainfo.productIdentifier, datainfo.footprint)]
+
+
+def scene_box_stats(tif, dirs, boxes, split, bands, stats) :
+
+	"""
+	> Per box/subfield statistics of a processed scene for all the fields it intersects, in one pass over the
+	  raster per band (see field_registry.box_stats). The scene is linked to the data directory of every field
+	  {field name : directory} and its table saved next to the link (read by IDP.box_stats in drivers_creation)
+	"""
+
+	from field_registry import box_stats, boxstatsfile
+
+	zones = box_stats(boxes, tif, bands=bands, stats=stats)
+	for name, dstdir in dirs.items():
+		link(tif, dstdir)
+		table = boxstatsfile('%s/%s' %(dstdir,os.path.basename(tif)), split)
+		zones[zones.field == name].to_csv(table + '.tmp', index=False, float_format='%.17g')
+		os.replace(table + '.tmp', table)
+
+
+def s1_region_process(region, url, idps, poly, boxes, split) :
+	fold = os.path.basename(url)
+	region.S1_scene_to_VVVH(fold, poly)
+	tif = '%s/s1_data/ASF_downloads/processed/Subset_%s_Orb_NR_Cal_ML_TC_dB.tif' %(region.workingdir,fold[:-4])
+	dirs = dict((idp.fieldname, '%s/s1_data/ASF_downloads/processed' %idp.workingdir) for idp in idps)
+	scene_box_stats(tif, dirs, boxes, split, (1,2), ['mean','std'])
+
+
+def s2_region_process(region, tile_id, idps, boxes, split) :
+	fold = '%s.SAFE' %tile_id
+	region.S2_scene_to_LAI(fold)
+	tif = '%s/AWS_downloads/processed/%s_p2.tif' %(region.s2_data_dir,fold[:-4])
+	dirs = dict((idp.fieldname, '%s/AWS_downloads/processed' %idp.s2_data_dir) for idp in idps)
+	scene_box_stats(tif, dirs, boxes, split, (1,), ['mean','std','count'])
+
+
+def region_idp(idps, registry, sharedir) :
+
+	"""
+	> IDP instance for the bounding box of many fields (downloads/processing shared by all of them in sharedir)
+	"""
+
+	from shapely.geometry import mapping
+	from input_data_production import IDP
+
+	os.makedirs(sharedir, exist_ok=True)
+	jsonloc = '%s/region.geojson' %sharedir
+	with open(jsonloc,'w') as f :
+		json.dump({'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': {}, 'geometry': mapping(registry.extent())}]}, f)
+
+	i = idps[0]
+	return IDP(jsonloc, sharedir, i.startdate, i.enddate, i.asf_usrname, i.asf_pass, i.snap_graphs_dir, i.snap_gtp_dir, i.cloudcovmax, S2_res=i.S2_res)
+
+
+def store_drivers(store, idp, pipe, info) :
+
+	"""
+	> Adds the drivers of a field to the driver store (then callback of its drivers task, run in the main
+	  process : the drivers tasks run in worker processes and an HDF5 file can not be written by several processes)
+	"""
+
+	from driver_store import DriverStore
+
+	inputs = '%s/DALEC_Grass/inputs' %idp.workingdir
+	with DriverStore(store,'a') as ds :
+		ds.put(idp.fieldname, np.load('%s/met_%s.npy' %(inputs,idp.fieldname)), np.load('%s/lai_obs_%s.npy' %(inputs,idp.fieldname)),
+			   lat=info['lat'], lon=info['lon'], dates=info['dates'])
+
+
+def train_lai_model(idps, modelloc, split, tile) :
+
+	"""
+	> Trains the S1->LAI RF of a tile/region once on the pooled box/subfield data of its fields (fields whose
+	  data can not be read are left out) ; returns the test score, None if the model already existed
+	"""
+
+	from lai_retrieval import LAI_RF
+
+	def frames() :
+		DFs = []
+		for idp in idps:
+			try:
+				DFs.append(idp.LAI_training_data(split, tile))
+			except Exception as e :
+				print ('%s left out of the LAI model %s : %r' %(idp.fieldname,modelloc,e))
+		if len(DFs) == 0 : raise ValueError('no training data for the LAI model %s' %modelloc)
+		return DFs
+
+	return LAI_RF(modelloc).train_once(frames, region=tile)
+
+
+def add_lai_model(pipe, key, idps, modelloc, queries, drivers_kwargs={}) :
+
+	## LAI model task of a tile/region : after the scene queries (their callbacks add the scene tasks it waits for) and all ERA5 years
+	## (a lai_model given in drivers_kwargs is used instead of modelloc, and only trained if it does not exist)
+	modelloc = drivers_kwargs.get('lai_model', modelloc)
+	era5 = ['era5:%s:%s' %(idp.fieldname,year) for idp in idps for year in idp.years]
+	pipe.add(key, 'drivers', train_lai_model, (idps, modelloc, drivers_kwargs.get('split',(5,5)), drivers_kwargs.get('tile','T30UVB')), deps=list(queries)+era5)
+	return key, modelloc
+
+
+def add_field_tasks(pipe, idp, deps, drivers_kwargs={}, mdf_kwargs=None, lai=None) :
+
+	## ERA5, drivers and calibration tasks of one field (lai : (key, location) of the tile/region LAI model task)
+	F = idp.fieldname
+	era5 = ['era5:%s:%s' %(F,year) for year in idp.years]
+	drivers_kwargs = dict(drivers_kwargs)
+	store = drivers_kwargs.pop('store', None)
+	then = functools.partial(store_drivers, store, idp) if store is not None else None
+	if lai is not None :
+		deps = list(deps) + [lai[0]]
+		drivers_kwargs['lai_model'] = lai[1]
+	pipe.add('drivers:%s' %F, 'drivers', functools.partial(idp.drivers_creation, **drivers_kwargs), deps=list(deps)+era5, then=then)
+	for key, year in zip(era5, idp.years):
+		pipe.add(key, 'download', idp.ERA5_download_year, (year,))
+
+	if mdf_kwargs is not None :
+		pipe.add('calibrate:%s' %F, 'calibrate', calibrate_field, (idp,mdf_kwargs), deps=['drivers:%s' %F])
+
+
+def add_field(pipe, idp, drivers_kwargs={}, mdf_kwargs=None, lai=None) :
+
+	"""
+	> Adds the tasks of one field (IDP instance) to a pipeline
+	> drivers_kwargs (dict) : arguments of IDP.drivers_creation (a driver store, store=..., is written by the main process)
+	> mdf_kwargs (dict)     : arguments of MDF.run (None = no calibration)
+	> lai (tuple)           : (key, location) of the LAI model task of the field's tile (see add_lai_model), which
+	                          then also waits for the field's scenes (None = the field's drivers task trains its own)
+	"""
+
+	F = idp.fieldname
+	drivers = 'drivers:%s' %F
+	waiting = [drivers] if lai is None else [drivers, lai[0]]
+
+	def add_s1_scenes(pipe, urls) :
+		for url in urls:
+			scene = os.path.basename(url)
+			pipe.add('s1_download:%s:%s' %(F,scene), 'download', idp.ASF_download_scene, (url,))
+			pipe.add('s1_process:%s:%s' %(F,scene), 'process', s1_process, (idp,url), deps=['s1_download:%s:%s' %(F,scene)])
+			for key in waiting: pipe.depend(key, 's1_process:%s:%s' %(F,scene))
+
+	def add_s2_scenes(pipe, tile_ids) :
+		for tile_id in tile_ids:
+			pipe.add('s2_download:%s:%s' %(F,tile_id), 'download', idp.AWS_download_scene, (tile_id,))
+			pipe.add('s2_process:%s:%s' %(F,tile_id), 'process', s2_process, (idp,tile_id), deps=['s2_download:%s:%s' %(F,tile_id)])
+			for key in waiting: pipe.depend(key, 's2_process:%s:%s' %(F,tile_id))
+
+	add_field_tasks(pipe, idp, ['s1_query:%s' %F,'s2_query:%s' %F], drivers_kwargs=drivers_kwargs, mdf_kwargs=mdf_kwargs, lai=lai)
+	pipe.add('s1_query:%s' %F, 'download', s1_query, (idp,), then=add_s1_scenes)
+	pipe.add('s2_query:%s' %F, 'download', s2_query, (idp,), then=add_s2_scenes)
+
+
+def add_fields(pipe, idps, sharedir, drivers_kwargs={}, mdf_kwargs=None) :
+
+	"""
+	> Adds the tasks of many neighbouring fields sharing their S1/S2 scenes (see field_registry.py) :
+	  the archives are queried once for the bounding box of all fields, each scene is downloaded and
+	  processed once (in sharedir), its per box/subfield statistics are extracted for all the fields it
+	  intersects in one pass, and it is linked (with its statistics) to the data directories of these fields.
+	  The LAI model of the region (<sharedir>/lai_rf_<tile>.joblib) is trained once on the data of all fields
+	> sharedir (str) : working directory of the shared downloads/processing
+	"""
+
+	from field_registry import FieldRegistry
+
+	registry = FieldRegistry.from_geojson([idp.jsonloc for idp in idps])
+	fields   = dict((idp.fieldname, idp) for idp in idps)
+	region   = region_idp(idps, registry, sharedir)
+	R        = os.path.basename(os.path.normpath(sharedir))
+	split    = drivers_kwargs.get('split', (5,5))
+	boxes    = registry.boxes(split)
+	lai      = add_lai_model(pipe, 'lai_rf:%s' %R, idps, '%s/lai_rf_%s.joblib' %(sharedir,drivers_kwargs.get('tile','T30UVB')),
+							 ['s1_query:%s' %R,'s2_query:%s' %R], drivers_kwargs)
+
+	## scenes (query results [id, footprint]) are fanned out to the fields they intersect, the others are dropped
+	def add_s1_scenes(pipe, scenes) :
+		for url, names in registry.fan_out(dict(scenes)).items():
+			scene = os.path.basename(url)
+			pipe.add('s1_download:%s:%s' %(R,scene), 'download', region.ASF_download_scene, (url,))
+			pipe.add('s1_process:%s:%s' %(R,scene), 'process', s1_region_process, (region,url,[fields[n] for n in names],registry.extent(names).wkt,boxes,split), deps=['s1_download:%s:%s' %(R,scene)])
+			pipe.depend(lai[0], 's1_process:%s:%s' %(R,scene))
+			for n in names: pipe.depend('drivers:%s' %n, 's1_process:%s:%s' %(R,scene))
+
+	def add_s2_scenes(pipe, scenes) :
+		for tile_id, names in registry.fan_out(dict(scenes)).items():
+			pipe.add('s2_download:%s:%s' %(R,tile_id), 'download', region.AWS_download_scene, (tile_id,))
+			pipe.add('s2_process:%s:%s' %(R,tile_id), 'process', s2_region_process, (region,tile_id,[fields[n] for n in names],boxes,split), deps=['s2_download:%s:%s' %(R,tile_id)])
+			pipe.depend(lai[0], 's2_process:%s:%s' %(R,tile_id))
+			for n in names: pipe.depend('drivers:%s' %n, 's2_process:%s:%s' %(R,tile_id))
+
+	for idp in idps:
+		add_field_tasks(pipe, idp, ['s1_query:%s' %R,'s2_query:%s' %R], drivers_kwargs=drivers_kwargs, mdf_kwargs=mdf_kwargs, lai=lai)
+	pipe.add('s1_query:%s' %R, 'download', s1_region_query, (region,), then=add_s1_scenes)
+	pipe.add('s2_query:%s' %R, 'download', s2_region_query, (region,), then=add_s2_scenes)
+
+
+
+def run(idps, statefile, workers=None, drivers_kwargs={}, calibrate=True, sharedir=None, **mdf_kwargs) :
+
+	"""
+	> Builds and runs the pipeline of many fields
+	> idps (list)      : IDP instances (one per field)
+	> calibrate (bool) : also run MDF.run for every field (with **mdf_kwargs) once its drivers are ready
+	> sharedir (str)   : if given, neighbouring fields share their scene downloads/processing (see add_fields)
+	> Without sharedir, the LAI model of every S2 tile (drivers_kwargs tile) is trained once on the data of all
+	  fields and saved next to statefile (lai_rf_<tile>.joblib) or to the drivers_kwargs lai_model
+	> Returns the Pipeline (see .failed and .timings)
+	"""
+
+	pipe = Pipeline(statefile, workers=workers)
+	mdf_kwargs = mdf_kwargs if calibrate else None
+	if sharedir is not None : add_fields(pipe, idps, sharedir, drivers_kwargs=drivers_kwargs, mdf_kwargs=mdf_kwargs)
+	else :
+		tile = drivers_kwargs.get('tile','T30UVB')
+		lai = add_lai_model(pipe, 'lai_rf:%s' %tile, idps, '%s/lai_rf_%s.joblib' %(os.path.dirname(os.path.abspath(statefile)),tile),
+							[q %idp.fieldname for idp in idps for q in ['s1_query:%s','s2_query:%s']], drivers_kwargs)
+		for idp in idps: add_field(pipe, idp, drivers_kwargs=drivers_kwargs, mdf_kwargs=mdf_kwargs, lai=lai)
+	pipe.run()
+	return pipe
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------------
+> Global sensitivity analysis of DALEC-Grass (Sobol indices of the 34 parameters for a site)
+Saltelli design over the pars_lims priors (scrambled Sobol sequence, N base samples = N x 36 forward runs),
+evaluated in batches of base samples over a process pool on the site's drivers. After every batch, the
+first-order (Saltelli et al. 2010) and total-order (Jansen 1999) indices of all outputs are re-estimated
+(vectorized over parameters and outputs) with bootstrap confidence intervals and written to outfile :
+rmse    : LAI RMSE against the site's observations
+gpp     : mean annual GPP (gC.m-2.yr-1)
+nee     : mean annual NEE (gC.m-2.yr-1)
+removed : mean annual removed C, grazed + cut (gC.m-2.yr-1)
+(over the reported period, from the site's firstweek). The parameter and output constraints of MDF are not applied,
+but diverged runs (nan or negative pools, fluxes or LAI) are treated as failed and only drop the estimator terms
+they are part of.
+Over the full pars_lims box many runs diverge : the indices only describe the valid part of the parameter space,
+and rest on the base samples with valid A and B runs. Their fraction ('valid' of every output) is written to outfile
+and printed after every batch, with a warning below min_valid
+
+> Usage
+import sensitivity
+res = sensitivity.run(workingdir, 'greatfield', N=4096, outfile='greatfield_sobol.json')
+for n, res in sensitivity.indices(workingdir, 'greatfield', N=4096): ...   # stream the estimates
+---------------------------------------------------------------------------------
+"""
+
+import os
+import json
+import warnings
+import datetime
+import multiprocessing
+import numpy as np
+from dalec_core import dalec_core, pars_lims
+
+
+outputs = ['rmse','gpp','nee','removed']
+
+site = None # dalec_core of the worker processes
+
+
+def init_worker(workingdir, sitename, store):
+	global site
+	site = dalec_core(workingdir, sitename, store=store)
+
+
+def evaluate(X):
+
+	"""
+	> Outputs (runs, outputs) of a block of parameter vectors (run in a worker process)
+	"""
+
+	Y = np.zeros((len(X), len(outputs))) + np.nan
+	w = site.firstweek # first week of the reported period
+	noyears = (site.nodays - w) / 52.
+	for i, pars in enumerate(X):
+		lai,gpp,nee,pools,fluxes,rem = site.forward(pars)
+		with np.errstate(invalid='ignore', divide='ignore') : Y[i,0] = site.rmse(lai)
+		Y[i,1] = (gpp[w:]*7).sum() / noyears
+		Y[i,2] = (nee[w:]*7).sum() / noyears
+		Y[i,3] = rem[:,w:].sum() / noyears
+		## diverged runs (the math constraints of dalec_core.output_constraints : nan or negative pools, fluxes or LAI)
+		if (np.isnan(pools[w:]).any() or np.any(pools[w:] < 0) or np.any(fluxes[w:] < 0) or np.any(lai[w:] < 0)) : Y[i] = np.nan
+	Y[~np.isfinite(Y)] = np.nan
+	return Y
+
+
+
+def saltelli(AB, lo, hi):
+
+	"""
+	> Saltelli design of a block of base samples AB (N, 2d) in [0,1] : runs (N, d+2, d) = A, B, A with column i from B
+	"""
+
+	d = len(lo)
+	A, B = AB[:,:d], AB[:,d:]
+	X = np.repeat(A[:,None,:], d+2, axis=1)
+	X[:,1] = B
+	i = np.arange(d)
+	X[:,2+i,i] = B[:,i]
+	return lo + X*(hi - lo)
+
+
+
+def estimate(Y):
+
+	"""
+	> First-order and total-order indices (d, outputs) from the outputs Y (N, d+2, outputs)
+	> Failed runs (nan) only drop the terms they are part of : the index of parameter i is estimated on the
+	  base samples where A, B and AB_i are all finite
+	"""
+
+	fA, fB, fAB = Y[:,0], Y[:,1], Y[:,2:]
+	V = np.nanvar(np.concatenate([fA, fB]), axis=0)
+	S1 = np.nanmean(fB[:,None] * (fAB - fA[:,None]), axis=0) / V
+	ST = 0.5 * np.nanmean((fA[:,None] - fAB)**2, axis=0) / V
+	return S1, ST
+
+
+
+def sobol(Y, nboot=200, level=0.95, rng=None):
+
+	"""
+	> Indices and bootstrap confidence intervals (resampling the base samples) of every output
+	> N : base samples with finite A and B runs, per output | valid : their fraction of all base samples
+	> runs_valid : fraction of finite runs (A, B and all AB_i), per output
+	"""
+
+	rng = rng or np.random.RandomState(0)
+	## indices without any valid estimator term (few valid base samples) are nan
+	with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings() :
+		warnings.simplefilter('ignore', RuntimeWarning)
+		S1, ST = estimate(Y)
+		boot = [estimate(Y[rng.randint(0, len(Y), len(Y))]) for b in range(nboot)]
+		q = [100*(1-level)/2, 100*(1+level)/2]
+		S1_ci = np.nanpercentile([b[0] for b in boot], q, axis=0)
+		ST_ci = np.nanpercentile([b[1] for b in boot], q, axis=0)
+	N = np.isfinite(Y[:,:2]).all(axis=1).sum(axis=0)
+	runs_valid = np.isfinite(Y).mean(axis=(0,1))
+
+	out = {}
+	for k, name in enumerate(outputs):
+		out[name] = {'N': int(N[k]), 'valid': N[k] / float(len(Y)), 'runs_valid': float(runs_valid[k]),
+					 'S1': S1[:,k].tolist(), 'S1_ci': S1_ci[:,:,k].T.tolist(), 'ST': ST[:,k].tolist(), 'ST_ci': ST_ci[:,:,k].T.tolist()}
+	return out
+
+
+
+def indices(workingdir, sitename, N=4096, batch=512, processes=None, nboot=200, level=0.95, seed=0, store=None, chunk=64):
+
+	"""
+	> Generator of the index estimates : yields (number of base samples so far, results) after every batch
+	> N (int)         : number of base samples (N x 36 forward runs ; powers of 2 for the balance of the Sobol sequence)
+	> batch (int)     : base samples per batch
+	> processes (int) : worker processes (default all cpus)
+	> nboot (int)     : bootstrap resamples of the confidence intervals (level)
+	> store          : driver store holding sitename (see driver_store.py), default <workingdir>/<sitename>_M.npy / _O.npy
+	> chunk (int)     : forward runs per task sent to a worker
+	"""
+
+	from scipy.stats import qmc
+
+	d  = len(pars_lims)
+	lo = np.array([pars_lims[i][0] for i in range(d)])
+	hi = np.array([pars_lims[i][1] for i in range(d)])
+	sequence = qmc.Sobol(2*d, scramble=True, seed=seed)
+	rng = np.random.RandomState(seed)
+
+	Y = np.zeros((0, d+2, len(outputs)))
+	pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(workingdir, sitename, store))
+	try:
+		while len(Y) < N :
+			n = min(batch, N - len(Y))
+			X = saltelli(sequence.random(n), lo, hi).reshape(-1, d)
+			blocks = pool.map(evaluate, [X[i:i+chunk] for i in range(0, len(X), chunk)])
+			Y = np.concatenate([Y, np.concatenate(blocks).reshape(n, d+2, len(outputs))])
+			yield len(Y), sobol(Y, nboot, level, rng)
+	finally:
+		pool.close()
+		pool.join()
+
+
+
+def run(workingdir, sitename, N=4096, outfile=None, min_valid=0.5, **kwargs):
+
+	"""
+	> Runs the sensitivity analysis, writes the estimates to outfile (JSON, default <workingdir>/sobol_<sitename>.json)
+	  after every batch and prints the fraction of valid base samples and the most influential parameters of every output
+	> min_valid (float) : fraction of valid base samples below which the indices are flagged (warning, 'low_valid' in outfile)
+	> Returns the results {output : {'N', 'valid', 'runs_valid', 'S1', 'S1_ci', 'ST', 'ST_ci'}}
+	"""
+
+	if outfile is None : outfile = '%s/sobol_%s.json' %(workingdir, sitename)
+	params = ['P%i' %(i+1) for i in range(len(pars_lims))]
+	res, low = {}, []
+	for n, res in indices(workingdir, sitename, N=N, **kwargs):
+		valid = dict((name, res[name]['valid']) for name in outputs)
+		low = [name for name in outputs if valid[name] < min_valid]
+		with open(outfile + '.tmp','w') as f :
+			json.dump({'site': sitename, 'N': n, 'valid': valid, 'low_valid': low, 'params': params, 'outputs': res,
+					   'updated': datetime.datetime.now().isoformat()}, f, indent=1)
+		os.replace(outfile + '.tmp', outfile)
+		print ('%i of %i base samples (%i runs), valid : %s' %(n, N, n*(len(params)+2), ', '.join('%s %i (%.1f %%)' %(name, res[name]['N'], 100*valid[name]) for name in outputs)))
+
+	if len(low) > 0 :
+		print ('WARNING : only %s of the base samples are valid for %s, the indices describe the valid part of the parameter space only'
+			   %(' / '.join('%.1f %%' %(100*valid[name]) for name in low), ', '.join(low)))
+	for name in res:
+		top = np.argsort(res[name]['ST'])[::-1][:5]
+		print ('%-8s total-order (%i valid base samples) : %s' %(name, res[name]['N'], ', '.join('%s %.2f' %(params[i], res[name]['ST'][i]) for i in top)))
+	return res
@@ -14,7 +14,7 @@ DESCRIPTION = 'A Bayesian model-data fusion algorithm for simulating carbon dyna
 LONG_DESCRIPTION = (HERE / "README.md").read_text()
 LONG_DESC_TYPE = "text/markdown"
 
-INSTALL_REQUIRES = ["numpy", "pandas","spotpy","sklearn","sentinelhub", "shapely", "datetime", "geopandas", "cdsapi"]
+INSTALL_REQUIRES = ["numpy", "pandas","spotpy","scikit-learn","sentinelhub", "shapely", "datetime", "geopandas", "cdsapi", "netCDF4", "h5py", "rasterio", "scipy", "joblib", "xarray", "rasterstats", "pathos"]
 PYTHON_REQUIRES = '>=3.8'
 
 setup(name=PACKAGE_NAME,
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import datetime
+
+
+class Telemetry() :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Hot-path instrumentation of an MDF run (see MDF.run(telemetry=...))
+	Records the cumulative time spent in the DALEC-Grass kernel, the likelihood (constraints + RMSE),
+	the sampler (spotpy bookkeeping, proposals, objective function) and the database writes,
+	counts rejected proposals per named constraint (dalec_core.check_pars / check_outputs),
+	tracks the throughput (evaluations/sec) and periodically writes a small JSON progress file
+	with the ETA of the run
+
+	> User inputs
+	progressfile (str) : location of the JSON metrics/progress file (None = no file)
+	repetitions (int)  : total number of evaluations of the run (for the ETA)
+	every (float)      : seconds between two writes of the progress file
+	---------------------------------------------------------------------------------
+	"""
+
+	def __init__(self, progressfile=None, repetitions=None, every=10.):
+
+		self.progressfile = progressfile
+		self.repetitions  = repetitions
+		self.every        = every
+		self.times        = {'kernel': 0., 'likelihood': 0., 'sampler': 0., 'db': 0.}
+		self.rejections   = {}
+		self.evaluations  = 0
+		self.accepted     = 0
+		self.sampler      = None
+		self.start        = time.perf_counter()
+		self.last_write   = self.start
+
+
+	def attach(self, sampler):
+
+		"""
+		> Wraps the kernel (setup.forward), likelihood (setup.simulation, and setup.simulations for batches) and database
+		  writes (sampler.save) of a spotpy sampler whose setup is a dalec_core
+		"""
+
+		self.sampler = sampler
+		setup   = sampler.setup
+		forward, simulation, simulations, save = setup.forward, setup.simulation, setup.simulations, sampler.save
+		clock   = time.perf_counter
+		self._simulation = 0.
+
+		def timed_forward(pars):
+			t0 = clock()
+			out = forward(pars)
+			self.times['kernel'] += clock() - t0
+			return out
+
+		def timed_simulation(vector):
+			t0 = clock()
+			out = simulation(vector)
+			self._simulation += clock() - t0
+			self.evaluations += 1
+			if setup.rejected is None : self.accepted += 1
+			else : self.rejections[setup.rejected] = self.rejections.get(setup.rejected, 0) + 1
+			if clock() - self.last_write > self.every : self.write()
+			return out
+
+		def timed_simulations(X):
+			t0 = clock()
+			out = simulations(X)
+			self._simulation += clock() - t0
+			self.evaluations += len(out)
+			for rejected in setup.rejections :
+				if rejected is None : self.accepted += 1
+				else : self.rejections[rejected] = self.rejections.get(rejected, 0) + 1
+			if clock() - self.last_write > self.every : self.write()
+			return out
+
+		def timed_save(*args, **kwargs):
+			t0 = clock()
+			out = save(*args, **kwargs)
+			self.times['db'] += clock() - t0
+			return out
+
+		setup.forward, setup.simulation, setup.simulations, sampler.save = timed_forward, timed_simulation, timed_simulations, timed_save
+		self.start = self.last_write = clock()
+		return self
+
+
+	def metrics(self):
+
+		"""
+		> Returns the current metrics (times in s, fractions of the elapsed time, rejections, throughput, ETA)
+		"""
+
+		elapsed = time.perf_counter() - self.start
+		self.times['likelihood'] = self._simulation - self.times['kernel']
+		self.times['sampler'] = max(0., elapsed - self._simulation - self.times['db'])
+		rate = self.evaluations / elapsed if elapsed > 0 else 0.
+
+		out = {'evaluations': self.evaluations,
+			   'repetitions': self.repetitions,
+			   'accepted': self.accepted,
+			   'elapsed': elapsed,
+			   'evaluations_per_sec': rate,
+			   'eta': None,
+			   'times': dict(self.times),
+			   'fractions': dict((k, v/elapsed if elapsed > 0 else 0.) for k, v in self.times.items()),
+			   'rejections': dict(sorted(self.rejections.items(), key=lambda x: -x[1])),
+			   'updated': datetime.datetime.now().isoformat()}
+		if (self.repetitions is not None) and (rate > 0) :
+			out['eta'] = max(0., (self.repetitions - self.evaluations) / rate)
+		if self.sampler is not None :
+			out['best_like'] = float(self.sampler.status.objectivefunction_max)
+		return out
+
+
+	def write(self):
+
+		"""
+		> Writes the metrics to the progress file (atomic replace)
+		"""
+
+		self.last_write = time.perf_counter()
+		if self.progressfile is None : return
+		with open(self.progressfile + '.tmp','w') as f : json.dump(self.metrics(), f, indent=1)
+		os.replace(self.progressfile + '.tmp', self.progressfile)
+
+
+	def summary(self):
+
+		"""
+		> Prints where the time went and why proposals were rejected
+		"""
+
+		m = self.metrics()
+		print ('%i evaluations in %.1f s (%.1f evaluations/sec), %i accepted' %(m['evaluations'],m['elapsed'],m['evaluations_per_sec'],m['accepted']))
+		for k in ['kernel','likelihood','sampler','db']:
+			print ('  %-12s %10.2f s  %5.1f %%' %(k, m['times'][k], 100*m['fractions'][k]))
+		for k, n in m['rejections'].items():
+			print ('  rejected by %-22s %10i  %5.1f %%' %(k, n, 100.*n/max(1,m['evaluations'])))
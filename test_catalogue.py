@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from catalogue import Catalogue, params
+
+repodir = os.path.dirname(os.path.abspath(__file__))
+
+sites = {'north': (50.9, -3.9, 0.2), 'south': (50.1, -3.8, 0.5), 'east': (50.5, -2.0, 0.8)}
+
+
+def outputs(level, n=200, seed=0):
+	## MDF output : like1 in run order (improving), parameters around level, a few infeasible rows
+	rng  = np.random.RandomState(seed)
+	outs = pd.DataFrame(level + 0.01*rng.randn(n, len(params)), columns=['par%s' %p for p in params])
+	outs.insert(0, 'like1', -1. + np.arange(n) / n)
+	outs.loc[:4, 'like1'] = -np.inf
+	return outs
+
+
+@pytest.fixture
+def cat(tmp_path):
+	cat = Catalogue(str(tmp_path / 'catalogue.sqlite'))
+	for site, (lat, lon, level) in sites.items():
+		cat.register(outputs(level), site, algorithm='sa', dates=('2015-01-05','2019-12-30'), lat=lat, lon=lon, evaluations=1000)
+	yield cat
+	cat.close()
+
+
+def test_runs_by_site_region_and_period(cat):
+	assert list(cat.runs().site) == ['east','north','south']
+	assert list(cat.runs(sites=['north','east']).site) == ['east','north']
+	assert list(cat.runs(bbox=(-4., 50., -3., 51.)).site) == ['north','south']
+	assert list(cat.runs(start='2016-01-01', end='2018-01-01').site) == ['east','north','south']
+	assert len(cat.runs(start='2014-01-01')) == 0
+	runs = cat.runs()
+	assert (runs.nosamples == 195).all() and np.allclose(runs.best_like, -1. + 199/200.)
+
+
+def test_latest_run_of_a_site(cat):
+	cat.register(outputs(0.3, seed=1), 'north', lat=50.9, lon=-3.9)
+	assert len(cat.runs(sites=['north'], latest=False)) == 2
+	latest = cat.runs(sites=['north'])
+	assert len(latest) == 1 and latest.run_id.iloc[0] == 4
+	assert np.isclose(cat.posterior('north').loc['P1','mean'], 0.3, atol=0.01)
+
+
+def test_best_topk_and_posterior(cat):
+	best = cat.best(bbox=(-4., 50., -3., 51.))
+	assert list(best.site) == ['north','south'] and (best['rank'] == 1).all()
+	top = cat.topk('south', k=3)
+	assert list(top['rank']) == [1,2,3]
+	assert (np.diff(top.like1) < 0).all()
+	post = cat.posterior('east')
+	assert list(post.index) == params
+	assert (post.q05 <= post.q50).all() and (post.q50 <= post.q95).all()
+	assert np.allclose(post['mean'], 0.8, atol=0.01)
+
+
+def test_where_selects_on_posterior_summaries(cat):
+	assert list(cat.where('P30', 'mean', min=0.4).site) == ['east','south']
+	assert list(cat.where('P30', 'q95', max=0.4).site) == ['north']
+	with pytest.raises(ValueError):
+		cat.where('P99')
+	with pytest.raises(ValueError):
+		cat.where('P1', 'median')
+
+
+def test_burnin_rows_are_left_out_of_the_summaries(cat):
+	## first half of the run at 0.1, second half at 0.9 : the summaries only see the second half, topk all rows
+	outs = outputs(0.1)
+	outs.loc[100:, ['par%s' %p for p in params]] += 0.8
+	outs['like1'] = outs.like1[::-1].values # best rows during the burn-in
+	cat.register(outs, 'chains', burnin=0.5, top=1.)
+	assert np.allclose(cat.posterior('chains')['mean'], 0.9, atol=0.01)
+	assert np.isclose(cat.topk('chains', k=1)['P1'].iloc[0], 0.1, atol=0.05)
+
+
+def test_unknown_centroid_is_null(cat):
+	cat.register(outputs(0.5), 'nowhere')
+	run = cat.runs(sites=['nowhere'])
+	assert run.lat.isna().all() and run.lon.isna().all()
+	assert 'nowhere' not in list(cat.runs(bbox=(-180., -90., 180., 90.)).site)
+
+
+def test_run_without_feasible_sets(cat):
+	cat.register(pd.DataFrame({'like1': [-np.inf]*3}), 'failed')
+	run = cat.runs(sites=['failed'])
+	assert run.nosamples.iloc[0] == 0 and run.best_like.isna().all()
+	assert len(cat.posterior('failed')) == 0
+
+
+def test_import_outputs(tmp_path):
+	for site, (lat, lon, level) in sites.items(): outputs(level).to_csv(str(tmp_path / ('MDF_outs_%s.csv' %site)), index=False)
+	cat = Catalogue(str(tmp_path / 'imported.sqlite'))
+	assert len(cat.import_outputs(str(tmp_path / 'MDF_outs_*.csv'), algorithm='sa')) == 3
+	runs = cat.runs()
+	assert list(runs.site) == ['east','north','south']
+	assert runs.outputs.iloc[0] == str(tmp_path / 'MDF_outs_east.csv')
+	cat.close()
+
+
+def test_register_run_centroid_and_demc_burnin(cat, tmp_path):
+	class Status : rep = 200
+	class Sampler : dbname, status, stop_reason = str(tmp_path / 'run'), Status(), 'rhat'
+	class Setup :
+		sitename, lat, firstweek = 'npy_site', 50.77, 1
+		dates = pd.date_range('2015-01-05', periods=10, freq='7D')
+	outs = outputs(0.1)
+	outs.loc[100:, ['par%s' %p for p in params]] += 0.8
+	outs.to_csv(Sampler.dbname + '.csv', index=False)
+
+	## site read from npy files : the latitude is the model default, no centroid
+	cat.register_run(Sampler(), Setup(), algorithm='demc')
+	run = cat.runs(sites=['npy_site'])
+	assert run.lat.isna().all() and run.lon.isna().all()
+	assert (run.algorithm.iloc[0], run.evaluations.iloc[0], run.stop_reason.iloc[0]) == ('demc', 200, 'rhat')
+	assert run.start_date.iloc[0].startswith('2015-01-12')
+	assert np.allclose(cat.posterior('npy_site')['mean'], 0.9, atol=0.01) # all post burn-in chain states
+
+	## site of a driver store : its centroid
+	Setup.sitename, Setup.lon = 'store_site', -3.9
+	cat.register_run(Sampler(), Setup())
+	run = cat.runs(sites=['store_site'])
+	assert (run.lat.iloc[0], run.lon.iloc[0]) == (50.77, -3.9)
+
+
+def test_runs_register_by_default(tmp_path):
+	import MDF
+	kwargs = dict(met=np.load('%s/greatfield_M.npy' %repodir), obs_lai=np.load('%s/greatfield_O.npy' %repodir), repetitions=300,
+				  Ntemp=50, window=None, warmstart='%s/benchmarks/greatfield_outs.csv' %repodir)
+	MDF.run(str(tmp_path), 'field', **kwargs)
+	cat = Catalogue(str(tmp_path / 'MDF_catalogue.sqlite'))
+	assert list(cat.runs().outputs) == [str(tmp_path / 'MDF_outs_field.csv')]
+	cat.close()
+	MDF.run(str(tmp_path), 'other', catalogue=False, **kwargs)
+	MDF.run(str(tmp_path), 'ram', dbformat='ram', **kwargs)
+	cat = Catalogue(str(tmp_path / 'MDF_catalogue.sqlite'))
+	assert list(cat.runs().site) == ['field']
+	cat.close()
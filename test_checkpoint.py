@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+import filecmp
+import shutil
+import numpy as np
+import pytest
+import MDF
+import checkpoint
+
+repodir = os.path.dirname(os.path.abspath(__file__))
+
+demc_kwargs = {'repetitions': 12000, 'algorithm': 'demc', 'demc_kwargs': {'check_every': 5}, 'catalogue': False}
+sa_kwargs   = {'repetitions': 1500, 'Ntemp': 50, 'window': None, 'catalogue': False}
+
+
+class Killed(Exception) :
+	pass
+
+
+def kill_after(monkeypatch, n):
+	## the run is killed right after its n-th checkpoint
+	save, calls = checkpoint.save, []
+	def killing_save(sampler, state):
+		save(sampler, state)
+		calls.append(1)
+		if (len(calls) == n) and not state['finished'] : raise Killed()
+	monkeypatch.setattr(checkpoint, 'save', killing_save)
+
+
+def read(dbname):
+	with open(dbname + '.csv') as f : return f.read()
+
+
+def same_csv(a, b):
+	## compared as files (a failing string comparison of two large csvs takes pytest minutes to render)
+	return filecmp.cmp(a + '.csv', b + '.csv', shallow=False)
+
+
+@pytest.fixture(scope='module')
+def demc_ref(tmp_path_factory):
+	## uninterrupted DE-MC run (no checkpoints), also the feasible start of the SA runs
+	dbname = str(tmp_path_factory.mktemp('demc') / 'ref')
+	np.random.seed(0)
+	sampler = MDF.run(repodir, 'greatfield', dbname=dbname, checkpoint_every=None, **demc_kwargs)
+	return dbname, sampler.status.rep
+
+
+def interrupted_and_resumed(dbname, monkeypatch, kill, every, **kwargs):
+	np.random.seed(0)
+	kill_after(monkeypatch, kill)
+	with pytest.raises(Killed) :
+		MDF.run(repodir, 'greatfield', dbname=dbname, checkpoint_every=every, **kwargs)
+	assert not checkpoint.load(dbname)['finished']
+	monkeypatch.undo()
+
+	## the rows written after the last checkpoint are dropped and the run continues with the RNG state of the checkpoint
+	np.random.seed(1)
+	sampler = MDF.run(repodir, 'greatfield', dbname=dbname, checkpoint_every=every, resume=True, **kwargs)
+	assert checkpoint.load(dbname)['finished']
+	return sampler
+
+
+def test_demc_resume_matches_uninterrupted_run(tmp_path, monkeypatch, demc_ref):
+	ref, rep = demc_ref
+	run = str(tmp_path / 'run')
+	sampler = interrupted_and_resumed(run, monkeypatch, 200, 0, **demc_kwargs)
+	assert same_csv(run, ref)
+	assert sampler.status.rep == rep
+	assert len(sampler.acceptance) == len(sampler.rhat)
+
+
+def test_sa_resume_matches_uninterrupted_run(tmp_path, monkeypatch, demc_ref):
+	ref, run = str(tmp_path / 'ref'), str(tmp_path / 'run')
+	kwargs = dict(sa_kwargs, warmstart=demc_ref[0] + '.csv')
+	np.random.seed(0)
+	MDF.run(repodir, 'greatfield', dbname=ref, checkpoint_every=None, **kwargs)
+	assert len(read(ref).splitlines()) > 100 # feasible rows saved
+
+	interrupted_and_resumed(run, monkeypatch, 3, 0, **kwargs)
+	assert same_csv(run, ref)
+
+
+def test_resume_of_a_finished_run_does_not_sample(tmp_path, demc_ref):
+	dbname = str(tmp_path / 'run')
+	kwargs = dict(sa_kwargs, warmstart=demc_ref[0] + '.csv')
+	MDF.run(repodir, 'greatfield', dbname=dbname, checkpoint_every=0, **kwargs)
+	shutil.copy(dbname + '.csv', dbname + '_before.csv')
+	sampler = MDF.run(repodir, 'greatfield', dbname=dbname, checkpoint_every=0, resume=True, **kwargs)
+	assert same_csv(dbname, dbname + '_before')
+	assert sampler.stop_reason == checkpoint.load(dbname)['stop_reason']
+
+
+def test_no_checkpoints_by_default(tmp_path, demc_ref):
+	dbname = str(tmp_path / 'run')
+	MDF.run(repodir, 'greatfield', dbname=dbname, warmstart=demc_ref[0] + '.csv', **sa_kwargs)
+	assert checkpoint.load(dbname) is None
+
+
+def test_due_and_missing_checkpoint(tmp_path):
+	class Sampler : pass
+	sampler = Sampler()
+	assert not checkpoint.due(sampler, None)
+	assert not checkpoint.due(sampler, 3600)
+	assert checkpoint.due(sampler, -1)
+	assert checkpoint.load(str(tmp_path / 'none')) is None
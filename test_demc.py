@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import spotpy
+from dalec_core import dalec_core, pars_lims
+from demc import demc, convergence, effective_obs
+
+repodir = os.path.dirname(os.path.abspath(__file__))
+
+
+class Gaussian() :
+
+	## stand-in for a dalec_core : standard normal posterior of 4 parameters within a uniform [-5,5] prior,
+	## the vectors with x0 below lowest are infeasible (-inf)
+	def __init__(self, lowest=-5.) :
+		self.lowest  = lowest
+		self.obs_lai = np.zeros(41) # neff = 40
+		self.obs_lai[::2] = 1.
+		self.neff    = effective_obs(self.obs_lai[:-1])
+		self.params  = [spotpy.parameter.Uniform('x%i' %i, -5., 5., step=1., optguess=0., minbound=-5., maxbound=5.) for i in range(4)]
+
+	def parameters(self): return spotpy.parameter.generate(self.params)
+
+	def evaluation(self): return [0]
+
+	def objectivefunction(self, simulation, evaluation): return -spotpy.objectivefunctions.mae(evaluation, simulation)
+
+	def simulation(self, vector):
+		x = np.array(vector, dtype=float)
+		return [np.exp(0.5*(x**2).sum()/self.neff) if x[0] >= self.lowest else -np.inf]
+
+	def simulations(self, X):
+		return np.array([self.simulation(x)[0] for x in X])
+
+
+def sampler(setup):
+	return demc(setup, dbname='toy', dbformat='ram', save_sim=True)
+
+
+def test_batch_matches_single_simulations():
+	setup = dalec_core(repodir, 'greatfield')
+	lims  = np.array([pars_lims[i] for i in range(len(pars_lims))])
+	outs  = pd.read_csv('%s/benchmarks/greatfield_outs.csv' %repodir)
+	X = np.vstack([np.array(outs.iloc[:10,1:], dtype=float), lims[:,0] + np.random.RandomState(0).rand(500, len(lims))*(lims[:,1] - lims[:,0])])
+	single, rejections = [], []
+	for x in X:
+		single.append(setup.simulation(x)[0])
+		rejections.append(setup.rejected)
+	np.testing.assert_array_equal(setup.simulations(X), single)
+	assert setup.rejections == rejections
+	assert rejections[:10] == [None]*10 and len(set(rejections)) > 3
+
+
+def test_convergence_diagnostics():
+	rng = np.random.RandomState(0)
+	iid = rng.randn(2000, 4, 3)
+	rhat, ess = convergence(iid)
+	assert (rhat < 1.01).all() and (np.abs(ess / iid[:,:,0].size - 1) < 0.2).all()
+	## a chain away from the others, a chain drifting (split halves)
+	apart = iid.copy()
+	apart[:,0] += 3.
+	drift = iid.copy()
+	drift[:,1] += np.linspace(0., 6., len(iid))[:,None]
+	for chains in [apart, drift]:
+		rhat, ess = convergence(chains)
+		assert (rhat > 1.2).all()
+
+
+def test_stops_once_converged():
+	np.random.seed(0)
+	s = sampler(Gaussian(lowest=-4.))
+	s.sample(200000, ess_min=400, check_every=50)
+	assert s.stop_reason == 'converged' and s.status.rep < 200000
+	assert (s.rhat[-1] < 1.1) and (s.ess[-1] >= 400)
+	data = s.getdata()
+	X = np.array([data['parx%i' %i] for i in range(4)]).T[len(data)//2:]
+	assert np.isfinite(data['like1']).all() and (X[:,0] >= -4.).all()
+	np.testing.assert_allclose(X.mean(axis=0), 0., atol=0.2)
+	np.testing.assert_allclose(X.std(axis=0), 1., atol=0.15)
+
+
+def test_initial_chains_keep_drawing_until_feasible():
+	## 1 % of the prior is feasible : the chains still all start feasible with no archive budget
+	np.random.seed(0)
+	s = sampler(Gaussian(lowest=4.9))
+	s.sample(5000, init_fraction=0., check_every=50)
+	data = s.getdata()
+	assert np.isfinite(data['like1']).all() and (data['parx0'] >= 4.9).all()
+	assert sorted(set(data['chain'])) == list(range(6))
+	## nothing feasible within the repetitions
+	with pytest.raises(RuntimeError):
+		sampler(Gaussian(lowest=6.)).sample(500)
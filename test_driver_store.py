@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import multiprocessing
+import numpy as np
+import pytest
+from driver_store import DriverStore
+from dalec_core import dalec_core
+
+repodir = os.path.dirname(os.path.abspath(__file__))
+met     = np.load('%s/greatfield_M.npy' %repodir)
+obs_lai = np.load('%s/greatfield_O.npy' %repodir)
+dates   = np.datetime64('2017-01-06') + 7*np.arange(met.shape[1])
+
+
+@pytest.fixture
+def storeloc(tmp_path):
+	storeloc = str(tmp_path / 'drivers.h5')
+	with DriverStore(storeloc, 'a') as ds :
+		ds.put('greatfield', met, obs_lai, lat=50.77, lon=-3.9, dates=dates)
+		ds.put('nodates', met[:,:104], obs_lai[:104])
+	return storeloc
+
+
+def test_round_trip(storeloc):
+	with DriverStore(storeloc) as ds :
+		assert sorted(ds.sites()) == ['greatfield','nodates']
+		assert 'greatfield' in ds and 'missing' not in ds
+		site = ds.get('greatfield')
+		np.testing.assert_array_equal(site['met'], met)
+		np.testing.assert_array_equal(site['obs_lai'], obs_lai)
+		np.testing.assert_array_equal(site['dates'], dates)
+		assert (site['lat'], site['lon']) == (50.77, -3.9)
+		site = ds.get('nodates')
+		assert site['dates'] is None and np.isnan(site['lat'])
+		assert site['met'].shape == (met.shape[0], 104)
+
+
+def test_put_replaces_a_site(storeloc):
+	with DriverStore(storeloc, 'a') as ds :
+		ds.put('nodates', met[:,:52], obs_lai[:52], lat=51., lon=-2.)
+	with DriverStore(storeloc) as ds :
+		assert ds.get('nodates')['met'].shape == (met.shape[0], 52)
+		assert ds.centroids() == {'greatfield': (50.77, -3.9), 'nodates': (51., -2.)}
+
+
+inherited = {}
+
+
+def read_in_child(site):
+	## store passed to the worker (pickled) or inherited through the fork
+	ds = site[1] if isinstance(site, tuple) else inherited['ds']
+	return ds.get(site[0] if isinstance(site, tuple) else site)['obs_lai'].sum()
+
+
+def test_forked_readers_reopen_the_store(storeloc):
+	ds = DriverStore(storeloc)
+	expected = ds.get('greatfield')['obs_lai'].sum() # parent handle open before the fork
+	inherited['ds'] = ds
+	with multiprocessing.get_context('fork').Pool(2) as pool :
+		assert pool.map(read_in_child, ['greatfield']*4) == [expected]*4
+		assert pool.map(read_in_child, [('greatfield', ds)]*4) == [expected]*4
+	## the parent's handle is still usable
+	assert ds.get('greatfield')['obs_lai'].sum() == expected
+	ds.close()
+	inherited.clear()
+
+
+def test_readers_while_the_store_is_written(storeloc):
+	## SWMR : read-only handles see the data flushed by a writer that keeps the store open
+	with DriverStore(storeloc, 'a') as writer :
+		writer.h5.swmr_mode = True
+		with DriverStore(storeloc) as reader :
+			np.testing.assert_array_equal(reader.get('greatfield')['met'], met)
+
+
+def test_setup_from_a_store_location(storeloc):
+	setup = dalec_core(repodir, 'greatfield', store=storeloc)
+	assert (setup.lat, setup.lon) == (50.77, -3.9)
+	np.testing.assert_array_equal(setup.obs_lai, obs_lai)
+	## the setup's read-only handle is closed : the store can be written again by this process
+	with DriverStore(storeloc, 'a') as ds :
+		ds.put('other', met, obs_lai)
+
+
+def test_import_npy(tmp_path):
+	with DriverStore(str(tmp_path / 'drivers.h5'), 'a') as ds :
+		ds.import_npy(repodir, lat=50.77)
+		assert ds.sites() == ['greatfield']
+		np.testing.assert_array_equal(ds.get('greatfield')['met'], met)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import json
+import pipeline
+
+
+def record(calls, key, fail=False):
+	## task function : records its call, fails on demand
+	def task():
+		calls.append(key)
+		if fail : raise ValueError('%s failed' %key)
+		return key
+	return task
+
+
+def test_runs_in_dependency_order(tmp_path):
+	calls = []
+	pipe = pipeline.Pipeline(str(tmp_path / 'state.json'))
+	pipe.add('c', 'process', record(calls, 'c'), deps=['a','b'])
+	pipe.add('a', 'download', record(calls, 'a'))
+	pipe.add('b', 'process', record(calls, 'b'), deps=['a'])
+	assert pipe.run() == {}
+	assert calls == ['a','b','c']
+	assert set(json.load(open(str(tmp_path / 'state.json')))['done']) == {'a','b','c'}
+
+
+def test_restart_skips_done_tasks(tmp_path):
+	statefile = str(tmp_path / 'state.json')
+	calls = []
+	pipe = pipeline.Pipeline(statefile)
+	pipe.add('a', 'download', record(calls, 'a'))
+	pipe.add('b', 'process', record(calls, 'b'), deps=['a'])
+	pipe.run()
+
+	calls = []
+	pipe = pipeline.Pipeline(statefile)
+	pipe.add('a', 'download', record(calls, 'a'))
+	pipe.add('b', 'process', record(calls, 'b'), deps=['a'])
+	pipe.add('c', 'process', record(calls, 'c'), deps=['b'])
+	assert pipe.run() == {}
+	assert calls == ['c']
+
+
+def test_failed_dependency_skips_and_is_retried(tmp_path):
+	statefile = str(tmp_path / 'state.json')
+	calls = []
+	pipe = pipeline.Pipeline(statefile)
+	pipe.add('a', 'download', record(calls, 'a'))
+	pipe.add('b', 'download', record(calls, 'b', fail=True))
+	pipe.add('c', 'process', record(calls, 'c'), deps=['a','b'])
+	failed = pipe.run()
+	assert set(failed) == {'b','c'}
+	assert failed['c'] == 'skipped (dependency failed)'
+	assert 'c' not in calls
+
+	## only the failed task and the tasks waiting on it run again
+	calls = []
+	pipe = pipeline.Pipeline(statefile)
+	pipe.add('a', 'download', record(calls, 'a'))
+	pipe.add('b', 'download', record(calls, 'b'))
+	pipe.add('c', 'process', record(calls, 'c'), deps=['a','b'])
+	assert pipe.run() == {}
+	assert calls == ['b','c']
+
+
+def test_unknown_dependency_is_skipped(tmp_path):
+	calls = []
+	pipe = pipeline.Pipeline(str(tmp_path / 'state.json'))
+	pipe.add('a', 'process', record(calls, 'a'), deps=['missing'])
+	assert pipe.run() == {'a': 'skipped (unknown dependency)'}
+	assert calls == []
+
+
+def test_callback_adds_tasks_and_is_replayed_on_restart(tmp_path):
+	statefile = str(tmp_path / 'state.json')
+
+	def build(calls):
+		pipe = pipeline.Pipeline(statefile)
+		def add_scenes(pipe, scenes):
+			for scene in scenes:
+				pipe.add('scene:%s' %scene, 'process', record(calls, 'scene:%s' %scene))
+				pipe.depend('drivers', 'scene:%s' %scene)
+		pipe.add('drivers', 'process', record(calls, 'drivers'), deps=['query'])
+		pipe.add('query', 'download', lambda: calls.append('query') or ['s1','s2'], then=add_scenes)
+		return pipe
+
+	calls = []
+	pipe = build(calls)
+	assert pipe.run() == {}
+	assert calls[0] == 'query' and calls[-1] == 'drivers'
+	assert sorted(calls[1:3]) == ['scene:s1','scene:s2']
+
+	## the recorded query result re-creates the scene tasks (done, not re-run)
+	calls = []
+	pipe = build(calls)
+	assert set(pipe.tasks) == {'query','drivers','scene:s1','scene:s2'}
+	assert pipe.tasks['drivers'][3] == ['query','scene:s1','scene:s2']
+	assert pipe.run() == {}
+	assert calls == []
+
+
+def test_failing_callback_fails_the_task(tmp_path):
+	calls = []
+	def callback(pipe, result):
+		raise RuntimeError('store locked')
+	pipe = pipeline.Pipeline(str(tmp_path / 'state.json'))
+	pipe.add('a', 'download', record(calls, 'a'), then=callback)
+	pipe.add('b', 'process', record(calls, 'b'), deps=['a'])
+	failed = pipe.run()
+	assert set(failed) == {'a','b'}
+	assert 'a' not in pipe.done
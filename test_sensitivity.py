@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import numpy as np
+import sensitivity
+from sensitivity import outputs, saltelli, estimate, sobol
+
+repodir = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_linear_model_indices():
+	## f = sum(c_i x_i), x_i uniform : S1_i = ST_i = c_i^2 / sum(c^2)
+	from scipy.stats import qmc
+	c  = np.array([4., 2., 1., 0.])
+	lo, hi = np.zeros(len(c)), np.ones(len(c))
+	X  = saltelli(qmc.Sobol(2*len(c), scramble=True, seed=0).random(1024), lo, hi)
+	S1, ST = estimate((X @ c)[:,:,None])
+	np.testing.assert_allclose(S1[:,0], c**2/(c**2).sum(), atol=0.02)
+	np.testing.assert_allclose(ST[:,0], c**2/(c**2).sum(), atol=0.02)
+
+
+def test_failed_runs_and_valid_fractions():
+	rng = np.random.RandomState(0)
+	d = 3
+	Y = rng.rand(10, d+2, len(outputs))
+	Y[0,0,:] = np.nan # A run of base sample 0 failed : all outputs
+	Y[1,1,2] = np.nan # B run of base sample 1 failed : nee only
+	Y[2,3,2] = np.nan # AB_1 run of base sample 2 failed : nee only, still a valid base sample
+	res = sobol(Y, nboot=50)
+	assert [res[name]['N'] for name in outputs] == [9, 9, 8, 9]
+	assert [res[name]['valid'] for name in outputs] == [0.9, 0.9, 0.8, 0.9]
+	assert np.isclose(res['nee']['runs_valid'], 1 - 3/50.) and np.isclose(res['rmse']['runs_valid'], 1 - 1/50.)
+	for name in outputs:
+		assert len(res[name]['S1']) == len(res[name]['ST']) == d
+		ci = np.array(res[name]['S1_ci'] + res[name]['ST_ci'])
+		assert ci.shape == (2*d, 2) and (ci[:,0] <= ci[:,1]).all()
+
+
+def test_small_run_of_a_site(tmp_path):
+	outfile = str(tmp_path / 'sobol.json')
+	res = sensitivity.run(repodir, 'greatfield', N=8, batch=4, processes=1, nboot=20, outfile=outfile)
+	with open(outfile) as f : saved = json.load(f)
+	assert saved['N'] == 8 and len(saved['params']) == 34
+	assert sorted(res) == sorted(outputs)
+	for name in outputs:
+		S1_ci, ST_ci = np.array(res[name]['S1_ci']), np.array(res[name]['ST_ci'])
+		assert len(res[name]['S1']) == len(res[name]['ST']) == 34
+		assert S1_ci.shape == ST_ci.shape == (34, 2)
+		## lower bound first (nan where the valid base samples do not identify the index)
+		for ci in [S1_ci, ST_ci]:
+			finite = np.isfinite(ci).all(axis=1)
+			assert (ci[finite,0] <= ci[finite,1]).all()
+		assert 0. <= res[name]['valid'] <= 1.
+		assert res[name]['valid'] == res[name]['N'] / 8.
+		assert saved['valid'][name] == res[name]['valid']
+		assert (name in saved['low_valid']) == (res[name]['valid'] < 0.5)
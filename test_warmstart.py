@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pandas as pd
+import MDF
+from dalec_core import pars_lims
+from warmstart import WarmStart, posterior, neighbours
+
+repodir = os.path.dirname(os.path.abspath(__file__))
+lims = np.array([pars_lims[i] for i in range(len(pars_lims))])
+
+
+def outputs(n=400, centre=0.3, spread=0.05, seed=0):
+	## MDF output : parameter sets around centre (fraction of the pars_lims range), like1 = -distance to it, a few infeasible rows
+	rng  = np.random.RandomState(seed)
+	u    = np.clip(centre + spread*rng.randn(n, len(lims)), 0., 1.)
+	outs = pd.DataFrame(lims[:,0] + u*(lims[:,1] - lims[:,0]), columns=['parP%i' %(i+1) for i in range(len(lims))])
+	outs.insert(0, 'like1', -np.abs(u - centre).sum(axis=1))
+	outs.loc[:9, 'like1'] = -np.inf
+	return outs
+
+
+def test_posterior_keeps_the_best_feasible_sets():
+	outs = outputs()
+	post = posterior(outs, top=0.1)
+	assert len(post) == int(0.1*(len(outs) - 10))
+	assert np.isfinite(post.like1).all()
+	assert post.like1.iloc[0] == outs.like1.max()
+	assert post.like1.min() >= outs.like1[np.isfinite(outs.like1)].quantile(0.85)
+
+
+def test_prior_is_narrowed_around_the_posterior_within_the_limits():
+	outs = outputs()
+	ws   = WarmStart(outs)
+	assert (ws.lo >= lims[:,0]).all() and (ws.hi <= lims[:,1]).all()
+	assert (ws.samples >= ws.lo).all() and (ws.samples <= ws.hi).all()
+	assert (ws.narrowing() <= 1.).all() and (ws.narrowing() < 0.5).mean() > 0.9
+	## SA starts from the best parameter set, with spotpy's step for a uniform prior
+	np.testing.assert_allclose(ws.start, outs.loc[outs.like1.idxmax()].values[1:])
+	np.testing.assert_allclose(ws.step, (ws.hi - ws.lo) / 10.)
+
+
+def test_sources_are_pooled(tmp_path):
+	csv = str(tmp_path / 'other.csv')
+	outputs(centre=0.7, seed=1).to_csv(csv, index=False)
+	one  = WarmStart(outputs())
+	both = WarmStart([outputs(), csv])
+	assert len(both.samples) == 2*len(one.samples)
+	assert (both.hi - both.lo > one.hi - one.lo).all()
+	assert both.sources == ['DataFrame', csv]
+	assert (np.diff(both.likes) <= 0).all() # best first
+
+
+def test_warm_start_sets_the_spotpy_prior():
+	ws    = WarmStart(outputs())
+	setup = MDF.abc_dalec(repodir, 'greatfield')
+	setup.prior = ws
+	params = setup.parameters()
+	np.testing.assert_allclose(params['minbound'], ws.lo)
+	np.testing.assert_allclose(params['maxbound'], ws.hi)
+	np.testing.assert_allclose(params['optguess'], ws.start)
+
+
+def test_neighbours_nearest_first():
+	centroids  = {'a': (50.8, -3.9), 'b': (50.9, -3.9), 'c': (51.5, -3.9), 'd': (50.8, -3.8), 'e': (52., 0.)}
+	calibrated = {'b': 'b.csv', 'c': 'c.csv', 'd': 'd.csv', 'a': 'a.csv', 'x': 'x.csv'}
+	near = neighbours('a', centroids, calibrated, n=2)
+	assert [n[0] for n in near] == ['d', 'b']
+	assert near[0][1] == 'd.csv'
+	assert 6. < near[0][2] < 8. and 10. < near[1][2] < 12.
+	assert [n[0] for n in neighbours('a', centroids, calibrated, n=5)] == ['d', 'b', 'c']
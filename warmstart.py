@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from dalec_core import pars_lims
+
+
+class WarmStart() :
+
+	"""
+	---------------------------------------------------------------------------------
+	> Warm-start prior of an MDF run from stored posteriors (see MDF.run(warmstart=...))
+	The best top fraction of the parameter sets of one or more earlier MDF runs (e.g. the same field's
+	previous season and/or the nearest calibrated fields, see neighbours()) is pooled into a posterior sample :
+	> prior : uniform between the quantiles of the posterior sample, widened on each side by widen x their
+	  distance (at least min_width x the pars_lims range) and truncated at pars_lims
+	> start : the best parameter set is the SA starting point (spotpy optguess), and the posterior sample the
+	  starting population of DE-MC (demc.sample(init=...))
+	SA and DE-MC only use the bounds, start and step size of the prior, so a narrowed box is all they need
+
+	> User inputs
+	sources (str / DataFrame / list) : MDF output csv(s) (or results DataFrames / sampler.getdata() arrays)
+	top (float)        : fraction of the best parameter sets of each source kept
+	quantiles (tuple)  : lower / upper quantile of the posterior sample
+	widen (float)      : widening of the quantile range on each side
+	min_width (float)  : minimum widening, fraction of the pars_lims range
+	---------------------------------------------------------------------------------
+	"""
+
+	def __init__(self, sources, top=0.05, quantiles=(0.01,0.99), widen=0.5, min_width=0.05):
+
+		if isinstance(sources, (str, pd.DataFrame, np.ndarray)) : sources = [sources]
+		posteriors = [posterior(source, top) for source in sources]
+		outs = pd.concat(posteriors).sort_values(by='like1', ascending=False)
+		pars = ['parP%i' %(i+1) for i in range(len(pars_lims))]
+
+		self.sources = [s if isinstance(s, str) else type(s).__name__ for s in sources]
+		self.samples = np.array(outs[pars], dtype=float)
+		self.likes   = np.array(outs.like1, dtype=float)
+
+		lims_lo = np.array([pars_lims[i][0] for i in range(len(pars_lims))])
+		lims_hi = np.array([pars_lims[i][1] for i in range(len(pars_lims))])
+		q_lo, q_hi = np.quantile(self.samples, quantiles, axis=0)
+		pad = np.maximum(widen*(q_hi - q_lo), min_width*(lims_hi - lims_lo))
+		self.lo    = np.maximum(lims_lo, q_lo - pad)
+		self.hi    = np.minimum(lims_hi, q_hi + pad)
+		self.start = np.clip(self.samples[0], self.lo, self.hi)
+		self.step  = 0.1 * (self.hi - self.lo) # as spotpy's default for a uniform prior
+
+
+	def narrowing(self):
+
+		"""
+		> Width of the warm-start prior relative to pars_lims, per parameter
+		"""
+
+		return (self.hi - self.lo) / np.array([pars_lims[i][1] - pars_lims[i][0] for i in range(len(pars_lims))])
+
+
+
+def posterior(source, top=0.05):
+
+	"""
+	> Best top fraction (by like1) of the feasible parameter sets of an MDF output (csv, DataFrame or array)
+	"""
+
+	outs = pd.read_csv(source) if isinstance(source, str) else pd.DataFrame(source)
+	outs = outs[np.isfinite(outs.like1.astype(float))].sort_values(by='like1', ascending=False)
+	return outs.iloc[:max(1, int(top*len(outs)))]
+
+
+
+def neighbours(sitename, centroids, calibrated, n=3):
+
+	"""
+	> The n calibrated sites nearest to sitename (great circle distance between centroids)
+	> centroids : {site : (lat, lon)} e.g. DriverStore.centroids()
+	> calibrated : {site : MDF output csv} of the already calibrated sites
+	> Returns the list of (site, output csv, distance in km), nearest first
+	"""
+
+	lat, lon = np.radians(centroids[sitename])
+	out = []
+	for site, outs in calibrated.items():
+		if (site == sitename) or (site not in centroids) : continue
+		lat2, lon2 = np.radians(centroids[site])
+		a = np.sin((lat2-lat)/2)**2 + np.cos(lat)*np.cos(lat2)*np.sin((lon2-lon)/2)**2
+		out.append((site, outs, float(2*6371.*np.arcsin(np.sqrt(a)))))
+	return sorted(out, key=lambda x: x[2])[:n]